@@ -0,0 +1,389 @@
+#! /usr/bin/python
+# -*- coding: utf-8 *-*
+
+# This file is part of the Beurer HRM python interface.
+# Copyright (C) 2013 Andres Moreno
+
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this file.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file computes training metrics from the recorded heart rates.
+#
+# The metrics are time in zones, rolling means, heart rate drift, recovery
+# slopes and training load (Banister TRIMP). The heart rates of many
+# trainings are joined into a single array and every metric is computed for
+# all of them at once with numpy, tagging each sample with its training.
+# HRAnalyzer keeps the metrics of a training up to date as samples arrive.
+import csv
+import sys
+import getopt
+import logging
+from array import array
+
+import numpy
+
+__VERSION__ = 0.1
+
+# Seconds between heart rate samples
+SAMPLE_SECONDS = 60
+# Heart rate at rest, the bottom of the heart rate reserve
+REST_HR = 60
+# Samples averaged by the rolling means
+ROLLING_WINDOW = 5
+# Samples over which the recovery slopes are measured
+RECOVERY_WINDOW = 2
+
+# Banister TRIMP weighting factors by gender, female (0) and male (1)
+_TRIMP_FACTORS = ((0.86, 1.67), (0.64, 1.92))
+
+_CSV_COLUMNS = ('file', 'session', 'samples', 'mean', 'max', 'drift',
+                'recovery', 'trimp')
+
+
+def zone_edges(report, fractions=None):
+    """Returns the heart rates where each zone of a report starts.
+
+    By default the zones are below the low limit, between the limits,
+    between the high limit and the maximum heart rate, and over it.
+
+    Args:
+        report -- HRMReport with the user limits
+        fractions -- Fractions of the maximum heart rate where each zone
+                     starts, instead of the limits
+
+    """
+    if fractions is None:
+        return [report.hr_llimit, report.hr_hlimit, report.hr_maximun]
+
+    return [fraction * report.hr_maximun for fraction in fractions]
+
+
+def time_in_zones(hr_data, edges, sample_seconds=SAMPLE_SECONDS):
+    """Returns the seconds spent in each zone, one zone more than edges."""
+    zones = numpy.searchsorted(edges, numpy.asarray(hr_data), side='right')
+    return numpy.bincount(zones, minlength=len(edges) + 1) * sample_seconds
+
+
+def rolling_mean(hr_data, window=ROLLING_WINDOW):
+    """Returns the mean of each sample and the window - 1 before it.
+
+    The first samples are averaged with the samples available.
+
+    """
+    sums = numpy.cumsum(numpy.asarray(hr_data, dtype=numpy.float64))
+    means = sums.copy()
+    means[window:] -= sums[:-window]
+    return means / numpy.minimum(numpy.arange(1, len(sums) + 1), window)
+
+
+def drift(hr_data):
+    """Returns the percent the second half mean is over the first half."""
+    hr_data = numpy.asarray(hr_data, dtype=numpy.float64)
+    half = len(hr_data) // 2
+    if not half:
+        return numpy.nan
+
+    return (hr_data[half:].mean() / hr_data[:half].mean() - 1) * 100
+
+
+def recovery_slopes(hr_data, window=RECOVERY_WINDOW,
+                    sample_seconds=SAMPLE_SECONDS):
+    """Returns the heart rate drop in beats per minute after each sample.
+
+    The drop is measured to the sample window samples later, so there are
+    window slopes less than samples. Rises are negative drops.
+
+    """
+    hr_data = numpy.asarray(hr_data, dtype=numpy.float64)
+    return (hr_data[:-window] - hr_data[window:]) / \
+        (window * sample_seconds / 60.0)
+
+
+def trimp(hr_data, hr_max, rest=REST_HR, gender=True,
+          sample_seconds=SAMPLE_SECONDS):
+    """Returns the Banister training impulse of the heart rates.
+
+    Every sample adds its minutes, times the fraction of the heart rate
+    reserve used, weighted exponentially by that fraction.
+
+    """
+    (factor, exponent) = _TRIMP_FACTORS[int(bool(gender))]
+    reserve = (numpy.asarray(hr_data, dtype=numpy.float64) - rest) / \
+        float(hr_max - rest)
+    reserve = numpy.maximum(reserve, 0)
+    return (sample_seconds / 60.0 * reserve * factor *
+            numpy.exp(exponent * reserve)).sum()
+
+
+def analyze_reports(reports, fractions=None, rest=REST_HR,
+                    recovery_window=RECOVERY_WINDOW,
+                    sample_seconds=SAMPLE_SECONDS):
+    """Compute the metrics of many trainings at once.
+
+    The values of a training without enough samples for a metric are
+    NaN.
+
+    Args:
+        reports -- HRMReport of each training
+        fractions -- Fractions of the maximum heart rate starting each
+                     zone, see zone_edges
+        rest -- Heart rate at rest
+        recovery_window -- Samples over which the recovery is measured
+        sample_seconds -- Seconds between heart rate samples
+
+    Returns a dictionary of arrays with one value per training: samples,
+    mean, max, zone_seconds (a row of seconds per training), drift,
+    recovery (the steepest drop in beats per minute) and trimp.
+
+    """
+    reports = list(reports)
+    count = len(reports)
+    lengths = numpy.array([len(report.hr_data) for report in reports],
+                          dtype=numpy.intp)
+    hr_data = numpy.frombuffer(
+        ''.join([report.hr_data.tostring() for report in reports]),
+        dtype=numpy.uint8).astype(numpy.float64)
+    # Training and position in the training of every sample
+    session = numpy.repeat(numpy.arange(count), lengths)
+    position = numpy.arange(len(hr_data)) - \
+        (numpy.cumsum(lengths) - lengths)[session]
+
+    zones = (3 if fractions is None else len(fractions)) + 1
+    edges = numpy.array([zone_edges(report, fractions) for report in reports],
+                        dtype=numpy.float64).reshape(count, zones - 1)
+    zone = (hr_data[:, numpy.newaxis] >= edges[session]).sum(axis=1)
+    zone_seconds = numpy.bincount(session * zones + zone,
+                                  minlength=count * zones)
+    zone_seconds = zone_seconds.reshape(count, zones) * sample_seconds
+
+    maximum = numpy.zeros(count)
+    numpy.maximum.at(maximum, session, hr_data)
+    second_half = position >= (lengths // 2)[session]
+    # bincount returns integers, even with weights, when there are no
+    # samples at all
+    half_sums = numpy.bincount(session * 2 + second_half, weights=hr_data,
+                               minlength=count * 2).reshape(count, 2)
+    half_sums = half_sums.astype(numpy.float64)
+    half_lengths = numpy.bincount(session * 2 + second_half,
+                                  minlength=count * 2).reshape(count, 2)
+
+    recovery = numpy.empty(count)
+    recovery.fill(numpy.nan)
+    if len(hr_data) > recovery_window:
+        first = session[:-recovery_window]
+        # Only the pairs of samples of the same training are measured
+        valid = position[:-recovery_window] + recovery_window < \
+            lengths[first]
+        numpy.fmax.at(recovery, first[valid],
+                      recovery_slopes(hr_data, recovery_window,
+                                      sample_seconds)[valid])
+
+    hr_max = numpy.array([report.hr_maximun for report in reports],
+                         dtype=numpy.float64)
+    factors = numpy.array([_TRIMP_FACTORS[int(bool(report.gender))]
+                           for report in reports]).reshape(count, 2)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        reserve = numpy.maximum((hr_data - rest) /
+                                (hr_max - rest)[session], 0)
+        impulses = sample_seconds / 60.0 * reserve * \
+            factors[session, 0] * numpy.exp(factors[session, 1] * reserve)
+        means = numpy.bincount(session, weights=hr_data,
+                               minlength=count).astype(numpy.float64) / \
+            lengths
+        halves = half_sums / half_lengths
+        drifts = (halves[:, 1] / halves[:, 0] - 1) * 100
+
+    maximum[lengths == 0] = numpy.nan
+    return {'samples': lengths,
+            'mean': means,
+            'max': maximum,
+            'zone_seconds': zone_seconds,
+            'drift': drifts,
+            'recovery': recovery,
+            'trimp': numpy.bincount(session, weights=impulses,
+                                    minlength=count).astype(numpy.float64)}
+
+
+def analyze(report, fractions=None, rest=REST_HR,
+            recovery_window=RECOVERY_WINDOW, sample_seconds=SAMPLE_SECONDS):
+    """Returns the metrics of a single training, see analyze_reports."""
+    results = analyze_reports([report], fractions, rest, recovery_window,
+                              sample_seconds)
+    return dict((name, values[0]) for (name, values) in results.items())
+
+
+class HRAnalyzer(object):
+
+    """Keep the metrics of a training while its samples arrive."""
+
+    def __init__(self, edges, hr_max, rest=REST_HR, gender=True,
+                 window=ROLLING_WINDOW, recovery_window=RECOVERY_WINDOW,
+                 sample_seconds=SAMPLE_SECONDS):
+        """Initializes the object.
+
+        Args:
+            edges -- Heart rates where each zone starts, see zone_edges
+            hr_max -- Maximum heart rate of the user
+            rest -- Heart rate at rest
+            gender -- True for male, False for female
+            window -- Samples averaged by the rolling means
+            recovery_window -- Samples over which the recovery is measured
+            sample_seconds -- Seconds between heart rate samples
+
+        """
+        self.edges = numpy.asarray(edges, dtype=numpy.float64)
+        self.hr_max = hr_max
+        self.rest = rest
+        self.gender = gender
+        self.window = window
+        self.recovery_window = recovery_window
+        self.sample_seconds = sample_seconds
+        self.samples = array('B')
+        self.zone_seconds = numpy.zeros(len(self.edges) + 1, dtype=numpy.intp)
+        self.total = 0.0
+        self.maximum = numpy.nan
+        self.recovery = numpy.nan
+        self.trimp = 0.0
+
+    @classmethod
+    def from_report(cls, report, fractions=None, **kwargs):
+        """Returns an analyzer of a report, fed with its heart rates."""
+        analyzer = cls(zone_edges(report, fractions), report.hr_maximun,
+                       gender=report.gender, **kwargs)
+        analyzer.update(report.hr_data)
+        return analyzer
+
+    def update(self, samples):
+        """Add new heart rate samples.
+
+        Returns the rolling means of the new samples, taking into account
+        the samples added before them.
+
+        """
+        new = numpy.asarray(samples, dtype=numpy.float64)
+        if not len(new):
+            return new
+
+        tail = numpy.frombuffer(
+            self.samples[-max(self.window, self.recovery_window):]
+            .tostring(), dtype=numpy.uint8)
+        self.samples.extend(array('B', new.astype(numpy.uint8).tostring()))
+        self.zone_seconds += time_in_zones(new, self.edges,
+                                           self.sample_seconds)
+        self.total += new.sum()
+        self.maximum = numpy.fmax(self.maximum, new.max())
+        self.trimp += trimp(new, self.hr_max, self.rest, self.gender,
+                            self.sample_seconds)
+        joined = numpy.concatenate((tail, new))
+        slopes = recovery_slopes(joined[-(len(new) + self.recovery_window):],
+                                 self.recovery_window, self.sample_seconds)
+        if len(slopes):
+            self.recovery = numpy.fmax(self.recovery, slopes.max())
+
+        # The tail is the whole training while it is shorter than a window
+        return rolling_mean(joined, self.window)[-len(new):]
+
+    def results(self):
+        """Returns the metrics of the samples added, as analyze does."""
+        count = len(self.samples)
+        return {'samples': count,
+                'mean': self.total / count if count else numpy.nan,
+                'max': self.maximum,
+                'zone_seconds': self.zone_seconds.copy(),
+                'drift': drift(numpy.frombuffer(self.samples.tostring(),
+                                                dtype=numpy.uint8)),
+                'recovery': self.recovery,
+                'trimp': self.trimp}
+
+
+def analyze_files(paths, fractions=None):
+    """Compute the metrics of every training of a list of dumps at once.
+
+    Returns a (trainings, results) tuple, trainings being a (path, number)
+    tuple per training and results the analyze_reports dictionary.
+
+    """
+    from parser import Parser
+    from section import map_file
+    trainings = []
+    reports = []
+    for path in paths:
+        for (ordinal, report) in enumerate(
+                Parser().iter_reports(map_file(path))):
+            trainings.append((path, ordinal))
+            reports.append(report)
+
+    return (trainings, analyze_reports(reports, fractions))
+
+
+def _show_help():
+    """Show the help message."""
+    print 'Beurer Heart Rate Monitor Analytics version: %s' % __VERSION__
+    print 'This software computes training metrics from the heart rates'
+    print ''
+    print 'Use:'
+    print ''
+    print '  analytics.py [-h] [-z fraction,...] path ...'
+    print ''
+    print '  -h,        Display this help message'
+    print '  -z zones,  Fractions of the maximum heart rate where each zone'
+    print '             starts, separated by commas. By default the zones'
+    print '             are given by the heart rate limits and maximum'
+    print ''
+    print 'Each path is a dump or a directory of dumps. A CSV row is'
+    print 'written for every training.'
+
+
+def main(argv):
+    """Run the analytics with the command line arguments."""
+    fractions = None
+
+    # Parser command line options
+    try:
+        opts, args = getopt.getopt(argv, "hz:")
+
+        for option in opts:
+            if option[0] == '-z':
+                fractions = [float(value) for value in option[1].split(',')]
+
+            elif option[0] == '-h':
+                _show_help()
+                exit(0)
+
+    except (getopt.GetoptError, ValueError):
+        _show_help()
+        sys.exit(2)
+
+    if not args:
+        _show_help()
+        sys.exit(2)
+
+    from verify import list_paths
+    (trainings, results) = analyze_files(list_paths(args), fractions)
+    zones = results['zone_seconds'].shape[1]
+    writer = csv.writer(sys.stdout)
+    writer.writerow(_CSV_COLUMNS[:5] +
+                    tuple('zone%s_seconds' % zone for zone in range(zones)) +
+                    _CSV_COLUMNS[5:])
+    for (number, (path, ordinal)) in enumerate(trainings):
+        writer.writerow([path, ordinal] +
+                        [results[name][number] for name in _CSV_COLUMNS[2:5]] +
+                        list(results['zone_seconds'][number]) +
+                        [results[name][number] for name in _CSV_COLUMNS[5:]])
+
+    logging.info('Analyzed %s trainings.' % len(trainings))
+    exit(0)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,135 @@
+#! /usr/bin/python
+# -*- coding: utf-8 *-*
+
+# This file is part of the Beurer HRM python interface.
+# Copyright (C) 2013 Andres Moreno
+
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this file.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file parses whole directories of dump files using a pool of
+# processes, writing every training found as a JSON line or a CSV row.
+import os
+import csv
+import json
+import struct
+import logging
+import itertools
+import multiprocessing
+
+from parser import Parser, map_file
+from report import FIELDS, REPORT_SUFFIX
+from exception import HRMException
+from index import INDEX_SUFFIX
+from sink import CHECKPOINT_SUFFIX
+
+FORMATS = ('jsonl', 'csv')
+
+_CSV_COLUMNS = ('file', 'session') + FIELDS + ('hr_samples', 'laps',
+                                               'error')
+
+
+def list_dumps(directory):
+    """Returns the paths of the dump files under a directory."""
+    paths = []
+    for (root, dirs, files) in os.walk(directory):
+        for name in files:
+            if not name.endswith((INDEX_SUFFIX, REPORT_SUFFIX,
+                                  CHECKPOINT_SUFFIX)):
+                paths.append(os.path.join(root, name))
+
+    paths.sort()
+    return paths
+
+
+def parse_dump(path):
+    """Parse every training of a dump file.
+
+    Returns a (path, records, error) tuple, records being the report
+    dictionaries of each training and error the error message, or None if
+    the file was parsed.
+
+    """
+    records = []
+    try:
+        # Cut dumps are reported, their last training is incomplete
+        parser = Parser(strict=True)
+        for (ordinal, report) in enumerate(
+                parser.iter_reports(map_file(path))):
+            record = report.to_dict()
+            record['file'] = path
+            record['session'] = ordinal
+            records.append(record)
+
+    except (HRMException, EnvironmentError, ValueError,
+            struct.error) as error:
+        return (path, records, str(error) or error.__class__.__name__)
+
+    return (path, records, None)
+
+
+def iter_results(paths, jobs):
+    """Iterate over the parse_dump results in completion order."""
+    if jobs == 1:
+        for result in itertools.imap(parse_dump, paths):
+            yield result
+
+        return
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap_unordered(parse_dump, paths):
+            yield result
+
+    finally:
+        pool.close()
+
+
+def run_batch(paths, output, jobs=None, format_='jsonl'):
+    """Parse a list of dumps writing the records as they are ready.
+
+    Args:
+        paths -- Paths of the dump files
+        output -- File object where the records are written
+        jobs -- Number of processes, by default one per cpu
+        format_ -- Output format, one of FORMATS
+
+    Returns the number of files that could not be parsed.
+
+    """
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    if format_ == 'csv':
+        writer = csv.DictWriter(output, _CSV_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+
+    errors = 0
+    for (path, records, error) in iter_results(paths, jobs):
+        if error is not None:
+            logging.warning('Can not parse %s: %s' % (path, error))
+            records.append({'file': path, 'error': error})
+            errors += 1
+
+        for record in records:
+            if format_ == 'csv':
+                if 'hr_data' in record:
+                    record['hr_samples'] = len(record['hr_data'])
+                    record['laps'] = len(record['laps'])
+
+                writer.writerow(record)
+
+            else:
+                output.write(json.dumps(record, sort_keys=True) + '\n')
+
+    return errors
@@ -0,0 +1,390 @@
+#! /usr/bin/python
+# -*- coding: utf-8 *-*
+
+# This file is part of the Beurer HRM python interface.
+# Copyright (C) 2013 Andres Moreno
+
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this file.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file measures the time and memory taken by each processing stage.
+#
+# A synthetic dump of the chosen size is written and every stage runs on it
+# in a fresh process, so the peak memory of a stage is not hidden by the
+# ones run before it. The results can be kept as a baseline, and later runs
+# are compared against the baseline of the same size.
+import os
+import sys
+import json
+import time
+import getopt
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+
+from synthetic import write_dump
+
+__VERSION__ = 0.1
+
+BASELINE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'bhrm',
+                             'benchmarks.json')
+
+# Trainings, longest training in minutes and most laps of each size
+SIZES = {'run': (1, 30, 1),
+         'month': (20, 90, 5),
+         'year': (250, 180, 10),
+         'years': (1000, 300, 20)}
+DEFAULT_SIZE = 'month'
+
+# Slow down over the baseline reported as a regression
+THRESHOLD = 0.1
+
+# Seconds a bhrm subcommand may take to start and show its help
+STARTUP_BUDGET = 0.25
+
+_BHRM = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bhrm')
+
+
+def _stage_parse(path):
+    """Parse every training of the mapped dump."""
+    from parser import Parser
+    from section import map_file
+    data = map_file(path)
+    return lambda: list(Parser().iter_reports(data))
+
+
+def _stage_parse_stream(path):
+    """Parse every training reading the dump as a stream."""
+    from parser import Parser
+
+    def parse():
+        hfile = open(path, 'rb')
+        reports = list(Parser().iter_reports(hfile))
+        hfile.close()
+        return reports
+
+    return parse
+
+
+def _sections(path):
+    """Returns the dump sections as lists of bytes, as downloaded."""
+    from parser import Parser
+    from section import map_file, read_bytes
+    return [map(ord, read_bytes(section.buffer, section.position,
+                                section.size))
+            for section in Parser().iter_sections(map_file(path))]
+
+
+def _stage_format(path):
+    """Format the downloaded sections as binary output."""
+    from beurer import _format_data
+    data = _sections(path)
+    return lambda: _format_data(data, False)
+
+
+def _stage_format_ascii(path):
+    """Format the downloaded sections as ascii output."""
+    from beurer import _format_data
+    data = _sections(path)
+    return lambda: _format_data(data, True)
+
+
+def _stage_plot_data(path):
+    """Get the data plotted by the visualizer."""
+    from visualizer import Visualizer
+    from section import map_file
+    data = map_file(path)
+    return lambda: Visualizer()._get_data(data)
+
+
+def _stage_download(path):
+    """Download the dump from a simulated monitor, without waiting."""
+    from beurer import HeartRateMonitor
+    from section import map_file
+    from simulator import SimulatedMonitor, SimulatedTransport
+    data = map_file(path)
+
+    def download():
+        monitor = SimulatedMonitor(data, time_scale=0)
+        hrt = HeartRateMonitor(transport=SimulatedTransport([monitor]))
+        return hrt.download_data(False)
+
+    return download
+
+
+def _stage_startup(command):
+    """Returns the stage starting a bhrm subcommand to show its help."""
+    def stage(path):
+        devnull = open(os.devnull, 'w')
+        return lambda: subprocess.call([sys.executable, _BHRM, command,
+                                        '-h'], stdout=devnull)
+
+    stage.__doc__ = 'Start bhrm %s and show its help.' % command
+    return stage
+
+
+STAGES = (('parse', _stage_parse),
+          ('parse_stream', _stage_parse_stream),
+          ('format', _stage_format),
+          ('format_ascii', _stage_format_ascii),
+          ('plot_data', _stage_plot_data),
+          ('download', _stage_download),
+          ('startup_download', _stage_startup('download')),
+          ('startup_parse', _stage_startup('parse')),
+          ('startup_plot', _stage_startup('plot')),
+          ('startup_verify', _stage_startup('verify')))
+
+
+def run_stage(name, path, repeat=3):
+    """Time a stage on a dump file.
+
+    The stage is run repeat times and the fastest run is kept. Run it in
+    its own process to get the peak memory of the stage alone.
+
+    Returns a dictionary with the seconds, the dump bytes processed per
+    second and the peak memory growth in KiB, or with the error if the
+    stage could not be run.
+
+    """
+    try:
+        stage = dict(STAGES)[name](path)
+
+    except ImportError as error:
+        return {'error': str(error)}
+
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    seconds = None
+    for run in range(repeat):
+        start = time.time()
+        stage()
+        elapsed = time.time() - start
+        if seconds is None or elapsed < seconds:
+            seconds = elapsed
+
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory
+    return {'seconds': seconds,
+            'throughput': os.path.getsize(path) / max(seconds, 1e-9),
+            'memory': memory}
+
+
+def run_benchmark(size=SIZES[DEFAULT_SIZE], stages=None, repeat=3, seed=0):
+    """Run the stages on a synthetic dump.
+
+    Args:
+        size -- (trainings, minutes, laps) of the dump, see SIZES
+        stages -- Names of the stages to run, all of them by default
+        repeat -- Runs of each stage, the fastest one is kept
+        seed -- Seed of the synthetic dump
+
+    Returns a dictionary of results by stage name, see run_stage.
+
+    """
+    if stages is None:
+        stages = [name for (name, stage) in STAGES]
+
+    (handle, path) = tempfile.mkstemp(prefix='bhrm-benchmark-')
+    os.close(handle)
+    results = {}
+    try:
+        write_dump(path, size[0], size[1], size[2], seed)
+        for name in stages:
+            pool = multiprocessing.Pool(1)
+            try:
+                results[name] = pool.apply(run_stage, (name, path, repeat))
+
+            finally:
+                pool.terminate()
+                pool.join()
+
+    finally:
+        os.remove(path)
+
+    return results
+
+
+def size_key(size, seed=0):
+    """Returns the baseline key of a dump size."""
+    return 'trainings=%s,minutes=%s,laps=%s,seed=%s' % (size + (seed,))
+
+
+def load_baselines(path=BASELINE_FILE):
+    """Returns the baselines kept, by size key."""
+    if not os.path.exists(path):
+        return {}
+
+    hfile = open(path, 'r')
+    baselines = json.load(hfile)
+    hfile.close()
+    return baselines
+
+
+def save_baseline(key, results, path=BASELINE_FILE):
+    """Keep the results as the baseline of a size key."""
+    baselines = load_baselines(path)
+    baselines.setdefault(key, {}).update(results)
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    hfile = open(path, 'w')
+    json.dump(baselines, hfile, indent=1, sort_keys=True)
+    hfile.close()
+
+
+def find_regressions(results, baseline, threshold=THRESHOLD):
+    """Returns the stages slower than their baseline by over threshold.
+
+    The startup stages are also reported when they take longer than
+    STARTUP_BUDGET.
+
+    """
+    regressions = []
+    for (name, result) in sorted(results.items()):
+        if 'seconds' not in result:
+            continue
+
+        old = baseline.get(name, {})
+        if 'seconds' in old and \
+                result['seconds'] > old['seconds'] * (1 + threshold):
+            regressions.append(name)
+
+        elif name.startswith('startup_') and \
+                result['seconds'] > STARTUP_BUDGET:
+            regressions.append(name)
+
+    return regressions
+
+
+def show_results(results, baseline, output=sys.stdout):
+    """Write the results table, with the change over the baseline."""
+    output.write('%-16s %10s %10s %12s %10s\n' %
+                 ('stage', 'seconds', 'MB/s', 'memory KiB', 'baseline'))
+    for (name, stage) in STAGES:
+        if name not in results:
+            continue
+
+        result = results[name]
+        if 'error' in result:
+            output.write('%-16s skipped: %s\n' % (name, result['error']))
+            continue
+
+        change = ''
+        old = baseline.get(name, {})
+        if old.get('seconds'):
+            change = '%+.1f%%' % ((result['seconds'] / old['seconds'] - 1) *
+                                  100)
+
+        output.write('%-16s %10.4f %10.2f %12d %10s\n' %
+                     (name, result['seconds'],
+                      result['throughput'] / 1e6, result['memory'], change))
+
+
+def _show_help():
+    """Show the help message."""
+    print 'Beurer Heart Rate Monitor Benchmark version: %s' % __VERSION__
+    print 'This software measures the processing of synthetic dumps'
+    print ''
+    print 'Use:'
+    print ''
+    print '  benchmark.py [-h] [-z size] [-n trainings] [-m minutes]'
+    print '               [-l laps] [-r repeat] [-t stage,...]'
+    print '               [-b baselinefile] [-s]'
+    print ''
+    print '  -h,        Display this help message'
+    print '  -z size,   Size of the dump: %s. %s by default' % \
+        (', '.join(sorted(SIZES)), DEFAULT_SIZE)
+    print '  -n number, Number of trainings, instead of a size'
+    print '  -m number, Longest training in minutes, instead of a size'
+    print '  -l number, Most laps of a training, instead of a size'
+    print '  -r number, Runs of each stage, the fastest is kept, 3 by'
+    print '             default'
+    print '  -t stages, Stages to run, separated by commas:'
+    print '             %s' % ', '.join(name for (name, stage) in STAGES)
+    print '  -b file,   Baselines file, %s by default' % BASELINE_FILE
+    print '  -s,        Keep the results as the baseline of the size'
+    print ''
+    print 'The exit status is 1 if a stage is over %d%% slower than its' % \
+        (THRESHOLD * 100)
+    print 'baseline, or if a bhrm command takes over %s seconds to' % \
+        STARTUP_BUDGET
+    print 'start.'
+
+
+if __name__ == '__main__':
+    size = list(SIZES[DEFAULT_SIZE])
+    stages = None
+    repeat = 3
+    baseline_file = BASELINE_FILE
+    saveflag = False
+
+    # Parser command line options
+    try:
+        argv = sys.argv[1:]
+        opts, args = getopt.getopt(argv, "hz:n:m:l:r:t:b:s")
+
+        for option in opts:
+            if option[0] == '-z':
+                size = list(SIZES[option[1]])
+
+            elif option[0] == '-n':
+                size[0] = int(option[1])
+
+            elif option[0] == '-m':
+                size[1] = int(option[1])
+
+            elif option[0] == '-l':
+                size[2] = int(option[1])
+
+            elif option[0] == '-r':
+                repeat = int(option[1])
+
+            elif option[0] == '-t':
+                stages = option[1].split(',')
+
+            elif option[0] == '-b':
+                baseline_file = option[1]
+
+            elif option[0] == '-s':
+                saveflag = True
+
+            elif option[0] == '-h':
+                _show_help()
+                exit(0)
+
+    except (getopt.GetoptError, ValueError, KeyError):
+        _show_help()
+        sys.exit(2)
+
+    if stages is not None and \
+            [name for name in stages if name not in dict(STAGES)] or \
+            repeat < 1 or min(size) < 1:
+        _show_help()
+        sys.exit(2)
+
+    size = tuple(size)
+    key = size_key(size)
+    baseline = load_baselines(baseline_file).get(key, {})
+    print 'Dump: %s' % key
+    results = run_benchmark(size, stages, repeat)
+    show_results(results, baseline)
+    if saveflag:
+        save_baseline(key, results, baseline_file)
+        exit(0)
+
+    regressions = find_regressions(results, baseline)
+    if regressions:
+        print 'Slower than the baseline: %s' % ', '.join(regressions)
+        exit(1)
+
+    exit(0)
@@ -30,53 +30,274 @@
 # -a: Turn ascii on, else the raw bytes are returned.
 # -o: Dumps the results into a file.
 
+import os
 import sys
+import time
+import errno
+import array
 import getopt
-import usb.core
-import usb.util
+import threading
 import logging
+import tempfile
 
 from exception import HRMException
+from transport import USBTransport
+from sink import CHECKPOINT_SUFFIX, OutputSink, format_section
+from parser import Parser
 
 __VERSION__ = 0.1
 
+# Times a section is requested again before giving up
+MAX_RETRIES = 3
+# Seconds before the first retry, doubled on every retry
+RETRY_DELAY = 0.5
+_RESUME_ERROR = 'The monitor data does not match the partial download ' \
+                '%s, remove it to download again.'
+
+ID_VENDOR = 0x0e6a  # MegaWin
+ID_PRODUCT = 0x0101  # Usb Bridge
+
+# Baud rates supported by the USB bridge, fastest first
+BAUD_RATES = (102400, 57600, 51200, 38400, 19200, 9600, 4800, 2400, 1200)
+DEFAULT_BAUD_RATE = 9600
+# Baud rate value selecting the fastest rate that works
+AUTO_BAUD_RATE = 'auto'
+# File where the best working baud rate of each device is remembered
+BAUD_RATES_FILE = os.path.join(os.path.expanduser('~'), '.config', 'bhrm',
+                               'baud_rates')
+# Serializes the updates of BAUD_RATES_FILE by the download threads
+_BAUD_RATES_LOCK = threading.Lock()
+
+# Bridge configuration values of each baud rate
+BAUD_RATE_CODES = {102400: '\x60', 57600: '\x50', 51200: '\x40',
+                   38400: '\x30', 19200: '\x20', 9600: '\x10',
+                   4800: '\x00', 2400: '\x90', 1200: '\x80'}
+
 
 class HeartRateMonitor(object):
 
     """Beurer Heart Rate Monitor Interface class."""
 
-    def __init__(self):
+    def __init__(self, device=None, bus=None, address=None, serial=None,
+                 transport=None):
         """Initialize the heart rate monitor.
 
         This function sets the initial parameters previous to any
-        communication.
+        communication. By default the first monitor found is used, give
+        a device returned by find_monitors, its bus and address or its
+        serial number to use a given one.
+
+        Args:
+            device -- USB device of the monitor
+            bus -- Bus number of the monitor
+            address -- Address of the monitor in the bus
+            serial -- Serial number of the monitor
+            transport -- Transport used to reach the monitor, USB by default
 
         """
-        self.id_vendor = 0x0e6a  # MegaWin
-        self.id_product = 0x0101  # Usb Bridge
-        self.device = None
+        if transport is None:
+            transport = USBTransport()
+
+        self.transport = transport
+        self.id_vendor = ID_VENDOR
+        self.id_product = ID_PRODUCT
+        self.device = device
+        self.bus = bus
+        self.address = address
+        self.serial = serial
+        self.baud_rate = None
+        self.auto_baud_rate = False
+        self.max_retries = MAX_RETRIES
+        self.retry_delay = RETRY_DELAY
+        # Transfer statistics of the last download
+        self.bytes_received = 0
+        self.transfer_time = 0.0
+        # Id, retries, latency and baud rate of every section received
+        self.section_stats = []
 
     def open(self):
         """Open connection to device"""
         logging.info('Opening device.')
-        self.device = usb.core.find(idVendor=self.id_vendor,
-                                    idProduct=self.id_product)
+        if self.device is None:
+            self.device = self._find_device()
+
         if self.device is None:
             raise HRMException("Heart Rate Monitor not found!")
 
         self.device.set_configuration()
 
-    def download_data(self, delete):
+    def name(self):
+        """Returns the device serial number, or its bus and address."""
+        serial = self.transport.get_serial(self.device)
+        if serial:
+            return serial
+
+        return '%03d-%03d' % (self.device.bus, self.device.address)
+
+    def _find_device(self):
+        """Returns the first attached device matching the selection."""
+        for device in self.transport.find_devices(self.id_vendor,
+                                                  self.id_product):
+            if self.bus is not None and device.bus != self.bus:
+                continue
+
+            if self.address is not None and device.address != self.address:
+                continue
+
+            if (self.serial is not None and
+                    self.transport.get_serial(device) != self.serial):
+                continue
+
+            return device
+
+        return None
+
+    def download_data(self, delete, baud_rate=DEFAULT_BAUD_RATE,
+                      checkpoint=None):
         """Connect and get all the training data from device
 
         Args:
             delete -- Delete the data from the HRM after being read
+            baud_rate -- Baud rate, or AUTO_BAUD_RATE
+            checkpoint -- Path of the partial download file, see iter_data
 
         """
+        return [map(int, response)
+                for response in self.iter_data(delete, baud_rate,
+                                               checkpoint)]
+
+    def iter_data(self, delete, baud_rate=DEFAULT_BAUD_RATE,
+                  checkpoint=None):
+        """Connect and iterate over the training data sections.
+
+        Each section response is yielded as soon as it has been received
+        and verified, while the next one is still to be requested.
+
+        With AUTO_BAUD_RATE the download starts one rate faster than the
+        best rate known for the device, or at the fastest one, and each
+        time a section is not received correctly after max_retries retries
+        it is requested again at the next slower rate. The rate that worked
+        is remembered for the next download.
+
+        With a checkpoint every section received is appended to that file.
+        If the file already exists, its sections are yielded first. The
+        monitor can only send its data from the start, so the sections
+        already saved are received again and checked against the file
+        before the download goes on after the last one.
+
+        Args:
+            delete -- Delete the data from the HRM after being read
+            baud_rate -- Baud rate, or AUTO_BAUD_RATE
+            checkpoint -- Path of the partial download file
+
+        """
+        received = []
+        if checkpoint is not None and os.path.exists(checkpoint):
+            received = _read_checkpoint(checkpoint)
+            logging.info('Resuming download after %s sections.' %
+                         len(received))
+
         self.open()
-        self.set_baud_rate(9600)
+        self.auto_baud_rate = baud_rate == AUTO_BAUD_RATE
+        if self.auto_baud_rate:
+            baud_rate = self._load_baud_rate()
+            if baud_rate is None:
+                baud_rate = BAUD_RATES[0]
+
+            elif baud_rate != BAUD_RATES[0]:
+                # The next faster rate is tried first, so the rate goes up
+                # again when the link gets better
+                baud_rate = BAUD_RATES[BAUD_RATES.index(baud_rate) - 1]
+
+        self.set_baud_rate(baud_rate)
         self.set_time_out(0xD0)
-        return self._get_all_data(delete)
+        return self._iter_all_data(delete, received, checkpoint)
+
+    def throughput(self):
+        """Returns the bytes per second received in the last download."""
+        if not self.transfer_time:
+            return 0.0
+
+        return self.bytes_received / self.transfer_time
+
+    def _fall_back(self):
+        """Set the next slower baud rate, returns False if not possible."""
+        if not self.auto_baud_rate or self.baud_rate == BAUD_RATES[-1]:
+            return False
+
+        self.set_baud_rate(BAUD_RATES[BAUD_RATES.index(self.baud_rate) + 1])
+        return True
+
+    def _device_key(self):
+        """Returns a string identifying the connected device."""
+        serial = self.transport.get_serial(self.device)
+        if serial:
+            return serial
+
+        ports = getattr(self.device, 'port_numbers', None) or ()
+        return '%s-%s' % (self.device.bus, '.'.join(map(str, ports)))
+
+    def _read_baud_rates(self):
+        """Returns the remembered baud rates by device key."""
+        rates = {}
+        if not os.path.exists(BAUD_RATES_FILE):
+            return rates
+
+        hfile = open(BAUD_RATES_FILE, 'r')
+        for line in hfile:
+            fields = line.split()
+            if len(fields) == 2 and fields[1].isdigit():
+                rates[fields[0]] = int(fields[1])
+
+        hfile.close()
+        return rates
+
+    def _load_baud_rate(self):
+        """Returns the remembered baud rate of the device, if any."""
+        with _BAUD_RATES_LOCK:
+            rate = self._read_baud_rates().get(self._device_key())
+
+        if rate not in BAUD_RATES:
+            return None
+
+        logging.info('Using the remembered baud rate %s.' % rate)
+        return rate
+
+    def _save_baud_rate(self):
+        """Remember the baud rate of the device.
+
+        A failure is only logged, the download is not affected.
+
+        """
+        with _BAUD_RATES_LOCK:
+            try:
+                self._write_baud_rate()
+
+            except EnvironmentError as error:
+                logging.warning('Can not remember the baud rate: %s' % error)
+
+    def _write_baud_rate(self):
+        """Write the baud rate of the device to BAUD_RATES_FILE."""
+        rates = self._read_baud_rates()
+        rates[self._device_key()] = self.baud_rate
+        directory = os.path.dirname(BAUD_RATES_FILE)
+        try:
+            os.makedirs(directory)
+
+        except OSError as error:
+            # Created by another process
+            if error.errno != errno.EEXIST or not os.path.isdir(directory):
+                raise
+
+        # Replaced at once, readers never see a partial file
+        (handle, temp_path) = tempfile.mkstemp(dir=directory)
+        hfile = os.fdopen(handle, 'w')
+        for key in sorted(rates):
+            hfile.write('%s %s\n' % (key, rates[key]))
+
+        hfile.close()
+        os.chmod(temp_path, 0644)
+        os.rename(temp_path, BAUD_RATES_FILE)
 
     def _receive_command_data(self):
         """Get data from a command sent to the device."""
@@ -133,36 +354,103 @@ class HeartRateMonitor(object):
         valid = (accumulator & 0x0FF) == msg[-1]
         return valid
 
-    def _get_all_data(self, delete):
-        """Get all the training data.
+    def _iter_all_data(self, delete, received=(), checkpoint=None):
+        """Iterate over the training data responses.
+
+        A section that is not received correctly is requested again, up to
+        max_retries times, waiting twice as long before every new attempt.
 
         Args:
             delete -- Delete the data from the HRM after being read
+            received -- Responses of a previous download to resume
+            checkpoint -- Path of the file where each response is appended
 
         """
-        buffer_ = []
+        self.bytes_received = 0
+        self.transfer_time = 0.0
+        self.section_stats = []
         msg = '\x91\x01\x00\x01\x93'  # Initial message
+        for response in received:
+            yield response
+
+        # Responses of the previous download received again
+        resumed = 0
+        retries = 0
         while True:
             if ord(msg[3]) == 0:
+                # Nothing is deleted if the monitor data changed
+                if resumed < len(received):
+                    raise HRMException(_RESUME_ERROR % checkpoint)
+
                 if delete:
                     logging.info('Deleting data from HRM.')
                     self.send_message(msg)
 
                 break
 
-            self.send_message(msg)
-            response = self._receive_command_data()
-            buffer_.append(map(int, response))
-            byte_count = self._receive_byte_count()
-            if not self._check_msg_checksum(response):
-                raise HRMException('Transmission error, bad checksum.')
+            start = time.time()
+            error = None
+            try:
+                self.send_message(msg)
+                response = self._receive_command_data()
+                byte_count = self._receive_byte_count()
+
+            except self.transport.errors as transfer_error:
+                error = 'Transmission error, %s.' % transfer_error
+
+            else:
+                if not self._check_msg_checksum(response):
+                    error = 'Transmission error, bad checksum.'
+
+                elif len(response) != byte_count:
+                    error = 'Transmission error, bytes lost.'
+
+            latency = time.time() - start
+            self.transfer_time += latency
+            if error is not None:
+                if retries < self.max_retries:
+                    delay = self.retry_delay * 2 ** retries
+                    # Nothing received yet, the baud rate is still being
+                    # tried and it is retried at once
+                    if self.auto_baud_rate and not self.bytes_received:
+                        delay = 0.0
+
+                    retries += 1
+                    logging.warning('%s Retry %s in %.1f seconds.' %
+                                    (error, retries, delay))
+                    time.sleep(delay)
+                    continue
+
+                if not self._fall_back():
+                    raise HRMException(error)
+
+                logging.warning('%s Retrying at %s baud.' %
+                                (error, self.baud_rate))
+                retries = 0
+                continue
+
+            self.section_stats.append({'id': response[0], 'retries': retries,
+                                       'latency': latency,
+                                       'baud_rate': self.baud_rate})
+            self.bytes_received += len(response)
+            retries = 0
+            msg = self._next_message(response)
+            if resumed < len(received):
+                if bytearray(response) != bytearray(received[resumed]):
+                    raise HRMException(_RESUME_ERROR % checkpoint)
 
-            if len(response) != byte_count:
-                raise HRMException('Transmission error, bytes lost.')
+                resumed += 1
+                continue
 
-            msg = self._next_message(response)
+            if checkpoint is not None:
+                _append_checkpoint(checkpoint, response)
+
+            yield response
 
-        return buffer_
+        logging.info('Received %s bytes at %.1f bytes/s.' %
+                     (self.bytes_received, self.throughput()))
+        if self.auto_baud_rate:
+            self._save_baud_rate()
 
     def _next_message(self, last_message):
         """Returns next message.
@@ -205,38 +493,14 @@ class HeartRateMonitor(object):
         if self.device is None:
             raise HRMException("Device not connected (Opened)")
 
-        if rate == 102400:
-            msg = '\x60'
-
-        elif rate == 57600:
-            msg = '\x50'
-
-        elif rate == 51200:
-            msg = '\x40'
-
-        elif rate == 38400:
-            msg = '\x30'
-
-        elif rate == 19200:
-            msg = '\x20'
-
-        elif rate == 9600:
-            msg = '\x10'
-
-        elif rate == 4800:
-            msg = '\x00'
-
-        elif rate == 2400:
-            msg = '\x90'
-
-        elif rate == 1200:
-            msg == '\x80'
-
-        else:
+        if rate not in BAUD_RATE_CODES:
             raise HRMException('Wrong baud rate.')
 
+        logging.info('Setting baud rate to %s.' % rate)
+        msg = BAUD_RATE_CODES[rate]
         self.device.ctrl_transfer(bm_request_type, b_request, value, index,
                                     msg)
+        self.baud_rate = rate
 
     def set_time_out(self, timeout):
         """Set device timeout"""
@@ -252,37 +516,150 @@ class HeartRateMonitor(object):
                                     msg)
 
 
-def _format_data(data, asciiflag):
-    """Format the HRM output."""
-    outputdata = ''
-    if asciiflag:
-        for row in data:
-            msg = ''
-            for byte in row:
-                msg += str(byte) + ' '
+def find_monitors(id_vendor=ID_VENDOR, id_product=ID_PRODUCT,
+                  transport=None):
+    """Returns the devices of every attached monitor."""
+    if transport is None:
+        transport = USBTransport()
+
+    return transport.find_devices(id_vendor, id_product)
+
+
+def device_serial(device, transport=None):
+    """Returns the serial number of a device, None if it has none."""
+    if transport is None:
+        transport = USBTransport()
+
+    return transport.get_serial(device)
+
+
+def download_all(directory, delete=False, baud_rate=DEFAULT_BAUD_RATE,
+                 asciiflag=False, devices=None, transport=None,
+                 fsync=False):
+    """Download every attached monitor at the same time.
+
+    Each monitor is downloaded by its own thread into its own dump file,
+    named after the device and the download time.
+
+    Args:
+        directory -- Directory where the dumps are written
+        delete -- Delete the data from the HRMs after being read
+        baud_rate -- Baud rate, or AUTO_BAUD_RATE
+        asciiflag -- Write the dumps as ascii
+        devices -- USB devices to download, all the monitors by default
+        transport -- Transport used to reach the monitors, USB by default
+        fsync -- Sync each dump to disk when it has been written
+
+    Returns a list of (name, path, error) tuples in the order of the
+    devices, error being None for the monitors downloaded.
+
+    """
+    if devices is None:
+        devices = find_monitors(transport=transport)
+
+    results = [None] * len(devices)
+    threads = []
+    for (index, device) in enumerate(devices):
+        thread = threading.Thread(target=_download_device,
+                                  args=(HeartRateMonitor(
+                                            device, transport=transport),
+                                        directory, delete, baud_rate,
+                                        asciiflag, fsync, results, index))
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    for (index, device) in enumerate(devices):
+        # The thread ended by an unexpected error
+        if results[index] is None:
+            results[index] = ('%03d-%03d' % (device.bus, device.address),
+                              None, 'Download failed.')
+
+    return results
+
+
+def _download_device(hrt, directory, delete, baud_rate, asciiflag, fsync,
+                     results, index):
+    """Download a single monitor of download_all into results[index]."""
+    name = hrt.name()
+    path = os.path.join(directory, '%s-%s' %
+                        (name, time.strftime('%Y%m%d%H%M%S')))
+    # Renamed when complete, the archive never holds a partial dump under
+    # a dump name
+    partial = path + CHECKPOINT_SUFFIX
+    sink = None
+    received = False
+    try:
+        sink = OutputSink(partial, asciiflag, fsync)
+        for row in hrt.iter_data(delete, baud_rate):
+            sink.write(row)
+
+        received = True
+        sink.close()
+        os.rename(partial, path)
+
+    except ((HRMException, EnvironmentError) +
+            hrt.transport.errors) as error:
+        logging.error('Can not download %s: %s' % (name, error))
+        if sink is not None and not sink.output.closed:
+            try:
+                sink.close()
+
+            except EnvironmentError:
+                pass
+
+        if received:
+            # The data may be deleted from the HRM already
+            logging.error('The data of %s is kept in %s.' % (name, partial))
+
+        elif os.path.exists(partial):
+            os.remove(partial)
+
+        results[index] = (name, None, str(error))
+        return
+
+    logging.info('Downloaded %s into %s.' % (name, path))
+    results[index] = (name, path, None)
+
+
+def _read_checkpoint(path):
+    """Returns the responses saved in a partial download file."""
+    hfile = open(path, 'rb')
+    data = hfile.read()
+    hfile.close()
+    responses = []
+    end = 0
+    for section in Parser().iter_sections(data):
+        end = section.position + section.size
+        responses.append(array.array('B', data[section.position:end]))
+
+    if end < len(data):
+        # Drop the incomplete section before appending new ones
+        hfile = open(path, 'r+b')
+        hfile.truncate(end)
+        hfile.close()
 
-            outputdata += msg + '\n'
+    return responses
 
-    else:
-        for row in data:
-            msg = ''
-            for byte in row:
-                msg += chr(byte)
 
-            outputdata += msg
+def _append_checkpoint(path, response):
+    """Append a response to a partial download file."""
+    hfile = open(path, 'ab')
+    response.tofile(hfile)
+    hfile.close()
 
-    return outputdata
 
+def _format_data(data, asciiflag):
+    """Format the HRM output."""
+    return ''.join([format_section(row, asciiflag) for row in data])
 
-def _write_data(outputfile, outputdata):
-    """Write data to console or file."""
-    if outputfile is None:
-        sys.stdout.write(outputdata)
 
-    else:
-        hfile = open(outputfile, 'wb')
-        hfile.write(outputdata)
-        hfile.close()
+def _show_throughput(hrt):
+    """Show the baud rate and throughput of the last download."""
+    sys.stderr.write('Received %s bytes at %s baud, %.1f bytes/s.\n' %
+                     (hrt.bytes_received, hrt.baud_rate, hrt.throughput()))
 
 
 def _show_help():
@@ -292,27 +669,51 @@ def _show_help():
     print ''
     print 'Use:'
     print ''
-    print '  beurer.py [-h] [-a] [-d] [-v level] [-o outputfile]'
+    print '  beurer.py [-h] [-a] [-d] [-f] [-v level] [-o outputfile]'
+    print '            [-p reportfile] [-b rate] [-s monitor]'
+    print '  beurer.py [-a] [-d] [-f] [-b rate] -m directory'
+    print '  beurer.py -l'
+    print '  beurer.py -r dumpfile [-b rate] [-o outputfile]'
     print ''
     print '  -h,        Display this help message'
     print '  -a,        Change the output to ascii'
-    print '  -o,        Redirect output to a file'
+    print '  -o,        Redirect output to a file. An interrupted download'
+    print '             is resumed from outputfile.part'
+    print '  -f,        Sync the output file to disk when the download'
+    print '             ends'
     print '  -d,        Delete de data from the HRM'
+    print '  -l,        List the attached monitors'
+    print '  -s id,     Monitor to read, given by its bus:address or by'
+    print '             its serial number'
+    print '  -m dir,    Read every attached monitor at the same time,'
+    print '             writing one dump per monitor into the directory'
+    print '  -b rate,   Baud rate, 9600 by default. With auto the fastest'
+    print '             working rate is found and remembered'
+    print '  -p file,   Parse the data while it is downloaded and save'
+    print '             the reports to a report file'
+    print '  -r file,   Replay a recorded dump through a simulated monitor'
+    print '             instead of the USB monitors, may be repeated'
     print '  -v level,  Set the verbose level'
     print '             1: Debug level'
     print '             2: Info level'
 
-if __name__ == '__main__':
-    data = None
-    outputdata = ''
+def main(argv):
+    """Run the downloader with the command line arguments."""
     outputfile = None
+    reportfile = None
     asciiflag = False
     deleteflag = False
+    fsyncflag = False
+    baud_rate = DEFAULT_BAUD_RATE
+    selection = {}
+    directory = None
+    listflag = False
+    transport = None
+    replays = []
 
     # Parser command line options
     try:
-        argv = sys.argv[1:]
-        opts, args = getopt.getopt(argv, "v:dhao:")
+        opts, args = getopt.getopt(argv, "v:dhlafo:p:b:s:m:r:")
 
         for option in opts:
             if option[0] == '-a':
@@ -321,9 +722,39 @@ if __name__ == '__main__':
             elif option[0] == '-o':
                 outputfile = option[1]
 
+            elif option[0] == '-p':
+                reportfile = option[1]
+
             elif option[0] == '-d':
                 deleteflag = True
 
+            elif option[0] == '-f':
+                fsyncflag = True
+
+            elif option[0] == '-l':
+                listflag = True
+
+            elif option[0] == '-m':
+                directory = option[1]
+
+            elif option[0] == '-r':
+                replays.append(option[1])
+
+            elif option[0] == '-s':
+                if ':' in option[1]:
+                    (bus, address) = option[1].split(':', 1)
+                    selection = {'bus': int(bus), 'address': int(address)}
+
+                else:
+                    selection = {'serial': option[1]}
+
+            elif option[0] == '-b':
+                if option[1] == AUTO_BAUD_RATE:
+                    baud_rate = AUTO_BAUD_RATE
+
+                else:
+                    baud_rate = int(option[1])
+
             elif option[0] == '-v':
                 if option[1] == '1':
                     level = logging.DEBUG
@@ -337,23 +768,93 @@ if __name__ == '__main__':
                 _show_help()
                 exit(0)
 
-    except getopt.GetoptError:
+    except (getopt.GetoptError, ValueError):
         _show_help()
         sys.exit(2)
 
-    # Get data
+    # Replay the recorded dumps instead of reading the USB monitors
+    if replays:
+        from section import map_file
+        from simulator import SimulatedMonitor, SimulatedTransport
+        transport = SimulatedTransport(
+            [SimulatedMonitor(map_file(path), address=number + 1)
+             for (number, path) in enumerate(replays)])
+
+    if listflag:
+        for device in find_monitors(transport=transport):
+            print '%03d:%03d %s' % (device.bus, device.address,
+                                    device_serial(device, transport) or '')
+
+        exit(0)
+
+    # Get the data of every monitor
+    if directory is not None:
+        results = download_all(directory, deleteflag, baud_rate, asciiflag,
+                               transport=transport, fsync=fsyncflag)
+        for (name, path, error) in results:
+            print '%s: %s' % (name, error or path)
+
+        if not results:
+            print 'Heart Rate Monitor not found!'
+            exit(2)
+
+        if [result for result in results if result[2] is not None]:
+            exit(2)
+
+        exit(0)
+
+    # Sections received are kept until the output is written, so a failed
+    # download can be resumed
+    checkpoint = None
+    if outputfile is not None:
+        checkpoint = outputfile + CHECKPOINT_SUFFIX
+
+    # Get data, writing and parsing each section as it arrives
+    if reportfile is not None:
+        from pipeline import DownloadPipeline
+        from report import save_reports
+        sink = OutputSink(outputfile, asciiflag, fsyncflag)
+        try:
+            hrt = HeartRateMonitor(transport=transport, **selection)
+            pipeline = DownloadPipeline(sink.write)
+            reports = pipeline.run(hrt, deleteflag, baud_rate, checkpoint)
+
+        except HRMException as error:
+            sink.close()
+            print error.msg
+            exit(2)
+
+        if baud_rate == AUTO_BAUD_RATE:
+            _show_throughput(hrt)
+
+        sink.close()
+        save_reports(reportfile, reports)
+        if checkpoint is not None:
+            os.remove(checkpoint)
+
+        exit(0)
+
+    # Get data, writing each section as it arrives
+    sink = OutputSink(outputfile, asciiflag, fsyncflag)
     try:
-        hrt = HeartRateMonitor()
-        data = hrt.download_data(delete=deleteflag)
+        hrt = HeartRateMonitor(transport=transport, **selection)
+        for row in hrt.iter_data(deleteflag, baud_rate, checkpoint):
+            sink.write(row)
 
     except HRMException as error:
+        sink.close()
         print error.msg
         exit(2)
 
-    if data is None:
-        exit(2)
+    sink.close()
+    if baud_rate == AUTO_BAUD_RATE:
+        _show_throughput(hrt)
 
-    # Write data
-    outputdata = _format_data(data, asciiflag)
-    _write_data(outputfile, outputdata)
-    exit(0)
\ No newline at end of file
+    if checkpoint is not None:
+        os.remove(checkpoint)
+
+    exit(0)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,170 @@
+#! /usr/bin/python
+# -*- coding: utf-8 *-*
+
+# This file is part of the Beurer HRM python interface.
+# Copyright (C) 2013 Andres Moreno
+
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this file.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file provides a disk cache of parsed reports.
+#
+# Entries are keyed by a hash of the raw data and the parser version, so
+# unchanged dumps are never decoded twice. When the cache grows over its
+# size limit the least recently used entries are removed.
+import os
+import hashlib
+import logging
+import tempfile
+import cPickle
+
+import parser
+from parser import Parser, map_file, BUFFER_TYPES
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'bhrm')
+# Default size limit in bytes
+CACHE_SIZE = 64 * 1024 * 1024
+
+_ENTRY_SUFFIX = '.pickle'
+
+
+class ReportCache(object):
+
+    """Disk cache of parsed HRM reports."""
+
+    def __init__(self, directory=CACHE_DIR, max_size=CACHE_SIZE):
+        """Initializes the object.
+
+        Args:
+            directory -- Directory where the entries are stored
+            max_size -- Size limit of the cache, in bytes
+
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, source):
+        """Returns the report of Parser.parse for the HRM data.
+
+        Args:
+            source -- Raw HRM data, as accepted by Parser.iter_sections
+
+        """
+        buffer_ = self._get_buffer(source)
+        key = self.key(buffer_, 'parse')
+        report = self.get(key)
+        if report is None:
+            report = Parser().parse(buffer_)
+            self.put(key, report)
+
+        return report
+
+    def parse_reports(self, source):
+        """Returns the list of reports of Parser.iter_reports."""
+        buffer_ = self._get_buffer(source)
+        key = self.key(buffer_, 'reports')
+        reports = self.get(key)
+        if reports is None:
+            reports = list(Parser().iter_reports(buffer_))
+            self.put(key, reports)
+
+        return reports
+
+    def key(self, buffer_, mode):
+        """Returns the cache key of the raw data parsed in a mode."""
+        digest = hashlib.sha1('%s:%s:' % (parser.__VERSION__, mode))
+        digest.update(buffer_)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns the cached value of a key, None if not cached."""
+        path = self._entry_path(key)
+        try:
+            hfile = open(path, 'rb')
+
+        except IOError:
+            self.misses += 1
+            return None
+
+        try:
+            value = cPickle.load(hfile)
+
+        except (cPickle.UnpicklingError, EOFError, ValueError):
+            logging.warning('Removing damaged cache entry %s.' % key)
+            hfile.close()
+            os.remove(path)
+            self.misses += 1
+            return None
+
+        hfile.close()
+        # Entries are evicted by modification time
+        os.utime(path, None)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store a value in the cache and evict the oldest entries."""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        (handle, temp_path) = tempfile.mkstemp(dir=self.directory)
+        hfile = os.fdopen(handle, 'wb')
+        cPickle.dump(value, hfile, cPickle.HIGHEST_PROTOCOL)
+        hfile.close()
+        os.rename(temp_path, self._entry_path(key))
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the size limit."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(_ENTRY_SUFFIX):
+                continue
+
+            path = os.path.join(self.directory, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        while total > self.max_size and entries:
+            (mtime, size, path) = entries.pop(0)
+            logging.info('Evicting cache entry %s.' % path)
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        """Remove every entry."""
+        if not os.path.isdir(self.directory):
+            return
+
+        for name in os.listdir(self.directory):
+            if name.endswith(_ENTRY_SUFFIX):
+                os.remove(os.path.join(self.directory, name))
+
+    def _entry_path(self, key):
+        """Returns the path of the file of a key."""
+        return os.path.join(self.directory, key + _ENTRY_SUFFIX)
+
+    def _get_buffer(self, source):
+        """Returns the HRM data as a buffer, reading streams."""
+        if isinstance(source, unicode):
+            return map_file(source)
+
+        if isinstance(source, BUFFER_TYPES):
+            return source
+
+        return source.read()
@@ -0,0 +1,76 @@
+#! /usr/bin/python
+# -*- coding: utf-8 *-*
+
+# This file is part of the Beurer HRM python interface.
+# Copyright (C) 2013 Andres Moreno
+
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this file.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file reduces long series to the points needed to plot them.
+#
+# Largest Triangle Three Buckets (Steinarsson, 2013) splits the series in
+# as many buckets as points wanted and keeps, from each bucket, the point
+# forming the largest triangle with the point kept before it and the mean
+# of the next bucket. Peaks and drops survive, which does not happen when
+# taking every nth sample or averaging.
+import numpy
+
+
+def lttb_indexes(x, y, threshold):
+    """Returns the indexes of the points kept by LTTB.
+
+    Args:
+        x -- Sequence of the x values, in increasing order
+        y -- Sequence of the y values
+        threshold -- Number of points to keep, 3 at least
+
+    """
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return numpy.arange(length)
+
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    # The first and last points are always kept, the rest is bucketed
+    edges = numpy.linspace(1, length - 1, threshold - 1).astype(numpy.intp)
+    edges[-1] = length - 1
+    indexes = numpy.empty(threshold, dtype=numpy.intp)
+    indexes[0] = 0
+    indexes[-1] = length - 1
+    selected = 0
+    for bucket in range(threshold - 2):
+        start = edges[bucket]
+        stop = edges[bucket + 1]
+        if bucket == threshold - 3:
+            next_x = x[-1]
+            next_y = y[-1]
+
+        else:
+            next_x = x[stop:edges[bucket + 2]].mean()
+            next_y = y[stop:edges[bucket + 2]].mean()
+
+        areas = numpy.abs((x[selected] - next_x) *
+                          (y[start:stop] - y[selected]) -
+                          (x[selected] - x[start:stop]) *
+                          (next_y - y[selected]))
+        selected = start + int(areas.argmax())
+        indexes[bucket + 1] = selected
+
+    return indexes
+
+
+def lttb(x, y, threshold):
+    """Returns the x and y arrays of the points kept by LTTB."""
+    indexes = lttb_indexes(x, y, threshold)
+    return (numpy.asarray(x)[indexes], numpy.asarray(y)[indexes])
@@ -0,0 +1,203 @@
+#! /usr/bin/python
+# -*- coding: utf-8 *-*
+
+# This file is part of the Beurer HRM python interface.
+# Copyright (C) 2013 Andres Moreno
+
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this file.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file provides an index of the sections of a dump file, so single
+# sections or trainings can be read without parsing the whole file.
+#
+# The index is kept in a sidecar file next to the dump, it is rebuilt
+# whenever the size or modification time of the dump changes.
+import os
+import struct
+import calendar
+import logging
+
+from parser import Parser, map_file
+from section import Section
+
+# Appended to the dump path to get the index path
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+
+# Magic, version, dump size, dump mtime and number of entries
+_INDEX_HEADER = struct.Struct('<4sBQdI')
+# Section id, offset, size, training ordinal and training start time
+_INDEX_ENTRY = struct.Struct('<BQIIq')
+_INDEX_MAGIC = 'BHRI'
+# Start time of the trainings without lap results
+NO_START_TIME = -1
+
+
+class SectionIndex(object):
+
+    """Index of the sections of a dump file."""
+
+    def __init__(self, path):
+        """Initializes the object.
+
+        Args:
+            path -- Path of the dump file
+
+        """
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        # (section id, offset, size, training, start time) tuples
+        self.entries = []
+        self._buffer = None
+
+    @classmethod
+    def open(cls, path):
+        """Returns the index of a dump, building it if it is out of date."""
+        index = cls(path)
+        if not index.load():
+            index.build()
+            index.save()
+
+        return index
+
+    def build(self):
+        """Walk the dump and index every section."""
+        logging.info('Indexing %s.' % self.path)
+        parser = Parser()
+        self.entries = []
+        for (ordinal, sections) in enumerate(
+                parser.iter_sessions(self._get_buffer())):
+            start = self._start_time(parser, sections)
+            for section in sections:
+                self.entries.append((section.id, section.offset,
+                                     section.size, ordinal, start))
+
+    def load(self):
+        """Load the index file, returns False if missing or out of date."""
+        if not os.path.exists(self.index_path):
+            return False
+
+        hfile = open(self.index_path, 'rb')
+        data = hfile.read()
+        hfile.close()
+        if len(data) < _INDEX_HEADER.size:
+            return False
+
+        (magic, version, size, mtime,
+         count) = _INDEX_HEADER.unpack_from(data)
+        if magic != _INDEX_MAGIC or version != INDEX_VERSION:
+            return False
+
+        stat = os.stat(self.path)
+        if size != stat.st_size or mtime != stat.st_mtime:
+            logging.info('Index of %s is out of date.' % self.path)
+            return False
+
+        if len(data) != _INDEX_HEADER.size + count * _INDEX_ENTRY.size:
+            return False
+
+        self.entries = [_INDEX_ENTRY.unpack_from(data, _INDEX_HEADER.size +
+                                                 i * _INDEX_ENTRY.size)
+                        for i in range(count)]
+        return True
+
+    def save(self):
+        """Write the index file."""
+        stat = os.stat(self.path)
+        hfile = open(self.index_path, 'wb')
+        hfile.write(_INDEX_HEADER.pack(_INDEX_MAGIC, INDEX_VERSION,
+                                       stat.st_size, stat.st_mtime,
+                                       len(self.entries)))
+        for entry in self.entries:
+            hfile.write(_INDEX_ENTRY.pack(*entry))
+
+        hfile.close()
+
+    def count_sessions(self):
+        """Returns the number of trainings in the dump."""
+        if not self.entries:
+            return 0
+
+        return self.entries[-1][3] + 1
+
+    def find(self, section_type=None, session=None, start=None, end=None):
+        """Returns the entries matching all the given criteria.
+
+        Args:
+            section_type -- Section type, the high nibble of the section id
+            session -- Training ordinal
+            start -- First training start time, as a datetime
+            end -- Last training start time, as a datetime
+
+        """
+        if start is not None:
+            start = calendar.timegm(start.timetuple())
+
+        if end is not None:
+            end = calendar.timegm(end.timetuple())
+
+        entries = []
+        for entry in self.entries:
+            (id_, offset, size, ordinal, start_time) = entry
+            if section_type is not None and id_ >> 4 != section_type:
+                continue
+
+            if session is not None and ordinal != session:
+                continue
+
+            if start is not None and start_time < start:
+                continue
+
+            if end is not None and (start_time > end or
+                                    start_time == NO_START_TIME):
+                continue
+
+            entries.append(entry)
+
+        return entries
+
+    def read_sections(self, entries):
+        """Returns the sections of the given entries."""
+        buffer_ = self._get_buffer()
+        return [Section(buffer_, entry[1]) for entry in entries]
+
+    def parse_session(self, session, parser=None):
+        """Returns the report of a training parsing only its sections."""
+        if parser is None:
+            parser = Parser()
+
+        sections = self.read_sections(self.find(session=session))
+        return parser.parse_sections(sections)
+
+    def _get_buffer(self):
+        """Returns the dump mapped into memory."""
+        if self._buffer is None:
+            self._buffer = map_file(self.path)
+
+        return self._buffer
+
+    def _start_time(self, parser, sections):
+        """Returns the training start time as seconds since the epoch."""
+        laps = [section for section in sections if section.type == 6]
+        if not laps:
+            return NO_START_TIME
+
+        try:
+            start = parser.parse_sections(laps).start_time()
+
+        except ValueError:
+            logging.warning('Invalid lap results date at offset %s.' %
+                            laps[0].offset)
+            return NO_START_TIME
+
+        return calendar.timegm(start.timetuple())
@@ -19,16 +19,185 @@
 
 # This file provides a class to encapsulate the interpreted data read from
 # the heart rate monitor
+#
+# The laps of a training are kept by a LapTable as parallel arrays, one
+# per lap field, so interval trainings with hundreds of laps take a few
+# bytes per lap. Each lap is reached through a Lap view of its row, and the
+# splits and lap statistics are computed over the arrays with numpy.
+#
+# A Lap created on its own, as Lap(id_), keeps its fields in a table of its
+# own, and LapTable.append copies it into the table.
+from array import array
+
+# Lap fields with the typecode of their arrays
+LAP_FIELDS = (('id', 'i'), ('hour', 'B'), ('min', 'B'), ('seg', 'B'),
+              ('hr', 'B'))
+
+
+def _view_property(name):
+    """Returns a property reading and writing a field of the lap row."""
+    def get(self):
+        return getattr(self.table, name)[self.index]
+
+    def set_(self, value):
+        getattr(self.table, name)[self.index] = value
+
+    return property(get, set_)
 
 
 class Lap(object):
 
-    """Class with lap information"""
+    """Class with lap information, a view of a LapTable row"""
+
+    __slots__ = ('table', 'index')
+
+    def __init__(self, id_=0, table=None, index=0):
+        """Initializes the object.
+
+        Args:
+            id_ -- Id of a new lap, with every other field to 0, when no
+                   table is given
+            table -- LapTable holding the lap
+            index -- Row of the lap in the table
+
+        """
+        if table is None:
+            table = LapTable()
+            table.append(id_)
+            index = 0
+
+        self.table = table
+        self.index = index
 
-    def __init__(self, id_):
+    id = _view_property('id')
+    hour = _view_property('hour')
+    min = _view_property('min')
+    seg = _view_property('seg')
+    hr = _view_property('hr')
+
+    def seconds(self):
+        """Returns the lap duration in seconds."""
+        return self.hour * 3600 + self.min * 60 + self.seg
+
+    def to_dict(self):
+        """Returns the lap data as a dictionary."""
+        return {'id': self.id, 'hour': self.hour, 'min': self.min,
+                'seg': self.seg, 'hr': self.hr}
+
+
+class LapTable(object):
+
+    """Laps of a training, kept as one array per field"""
+
+    def __init__(self):
         """Initializes the object."""
-        self.id = id_
-        self.hour = 0
-        self.min = 0
-        self.seg = 0
-        self.hr = 0
+        for (name, typecode) in LAP_FIELDS:
+            setattr(self, name, array(typecode))
+
+    def __len__(self):
+        return len(self.id)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError('Lap index out of range')
+
+        return Lap(table=self, index=index)
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield Lap(table=self, index=index)
+
+    def append(self, id_, hour=0, min_=0, seg=0, hr=0):
+        """Add a lap at the end of the table, returns its view.
+
+        Args:
+            id_ -- Id of the lap, or a Lap whose fields are copied
+            hour -- Hours of the lap duration
+            min_ -- Minutes of the lap duration
+            seg -- Seconds of the lap duration
+            hr -- Heart rate of the lap
+
+        """
+        if isinstance(id_, Lap):
+            (id_, hour, min_, seg, hr) = (id_.id, id_.hour, id_.min,
+                                          id_.seg, id_.hr)
+
+        self.id.append(id_)
+        self.hour.append(hour)
+        self.min.append(min_)
+        self.seg.append(seg)
+        self.hr.append(hr)
+        return Lap(table=self, index=len(self) - 1)
+
+    def extend(self, ids, hours, mins, segs, hrs):
+        """Add the laps given as a sequence of values per field."""
+        count = len(ids)
+        if not len(hours) == len(mins) == len(segs) == len(hrs) == count:
+            raise ValueError('Lap fields of different lengths')
+
+        for (values, (name, typecode)) in zip((ids, hours, mins, segs, hrs),
+                                              LAP_FIELDS):
+            field = getattr(self, name)
+            if isinstance(values, array) and values.typecode == typecode:
+                field.extend(values)
+
+            else:
+                field.fromlist(list(values))
+
+    def to_dicts(self):
+        """Returns the data of every lap as a list of dictionaries."""
+        return [dict(zip(('id', 'hour', 'min', 'seg', 'hr'), values))
+                for values in zip(self.id, self.hour, self.min, self.seg,
+                                  self.hr)]
+
+    def durations(self):
+        """Returns the duration of every lap in seconds, as a numpy array."""
+        import numpy
+        hour = numpy.frombuffer(self.hour, dtype=numpy.uint8)
+        min_ = numpy.frombuffer(self.min, dtype=numpy.uint8)
+        seg = numpy.frombuffer(self.seg, dtype=numpy.uint8)
+        return hour.astype(numpy.int64) * 3600 + \
+            min_.astype(numpy.int64) * 60 + seg
+
+    def splits(self):
+        """Returns the time in seconds at the end of every lap."""
+        return self.durations().cumsum()
+
+    def fastest(self):
+        """Returns the shortest lap, the first one on a tie, or None."""
+        if not len(self):
+            return None
+
+        return Lap(table=self, index=int(self.durations().argmin()))
+
+    def slowest(self):
+        """Returns the longest lap, the first one on a tie, or None."""
+        if not len(self):
+            return None
+
+        return Lap(table=self, index=int(self.durations().argmax()))
+
+    def hr_stats(self):
+        """Returns statistics of the lap heart rates.
+
+        Returns a dictionary with the mean, standard deviation, minimum and
+        maximum of the lap heart rates, and the mean weighted by the lap
+        durations, None if there are no laps.
+
+        """
+        if not len(self):
+            return None
+
+        import numpy
+        hr = numpy.frombuffer(self.hr, dtype=numpy.uint8).astype(float)
+        durations = self.durations()
+        weighted = hr.mean()
+        if durations.sum():
+            weighted = numpy.average(hr, weights=durations)
+
+        return {'mean': float(hr.mean()), 'std': float(hr.std()),
+                'min': int(hr.min()),
+                'max': int(hr.max()), 'weighted_mean': float(weighted)}
@@ -19,185 +19,428 @@
 
 # This file interpret the raw data read from the heart rate monitor
 import sys
+import mmap
+import struct
 import getopt
 import logging
+from array import array
 
-from report import HRMReport
+from report import HRMReport, LazyHRMReport, save_reports
 from exception import HRMException
-from lap import Lap
-
-__VERSION__ = 0.1
+from section import Section, FRAME_SIZE, END_SECTION, USER_SECTIONS
+from section import byte_at, read_bytes, section_length, section_size
+from section import map_file, check_section
+
+__VERSION__ = 0.2
+
+# Bytes read from the input stream at once
+CHUNK_SIZE = 4096
+# Inputs parsed in place instead of being read as a stream
+BUFFER_TYPES = (str, bytearray, buffer, memoryview, mmap.mmap)
+# Value of every BCD encoded byte
+BCD_TABLE = tuple(((byte >> 4) & 0xF) * 10 + (byte & 0xF)
+                  for byte in range(256))
+# Translation of a string of BCD encoded bytes to their values
+_BCD_BYTES = ''.join(chr(value) for value in BCD_TABLE)
+
+# Section layouts, the leading pad bytes skip the section id and length
+_HEADER = struct.Struct('<3x6B')
+_RESULTS = struct.Struct('<4xBxBx9B2B')
+_FITNESS = struct.Struct('<2x8B')
+_HEART_RATES = struct.Struct('<4x2B')
+_LAPS = struct.Struct('<4x6B')
+# Lap results: seg min hour hr, followed by three unknown bytes
+_LAP = struct.Struct('<4B')
+_LAP_SIZE = 7
 
 
 class Parser(object):
 
     """Interpret the raw data from the HRM."""
 
-    def __init__(self):
-        """Initializes the object"""
+    # Section decoders by section type, see register_decoder
+    decoders = {}
+    # Report fields set by the decoder of each section type
+    decoder_fields = {}
+
+    def __init__(self, lazy=False, strict=False):
+        """Initializes the object
+
+        Args:
+            lazy -- Return LazyHRMReport objects, which decode each section
+                    the first time one of its fields is used. The checksum
+                    of a section is checked when it is decoded
+            strict -- Raise HRMException when the data is cut, with bytes
+                      left after the last whole section or no end of data
+                      section, instead of ignoring the incomplete part
+
+        """
         super(Parser, self).__init__()
+        self.lazy = lazy
+        self.strict = strict
+
+    def parse(self, source):
+        """Parse the HRM data.
+
+        Args:
+            source -- Raw HRM data, see iter_sections
+
+        """
+        return self.parse_sections(self.iter_sections(source))
+
+    def parse_sections(self, sections):
+        """Parse the given sections into a new report.
+
+        Args:
+            sections -- Iterable of Section objects
+
+        """
+        if self.lazy:
+            sections = list(sections)
+            self.report = LazyHRMReport(self._decode_lazy, sections,
+                                        self.decoder_fields)
+            # Sections without known fields are parsed now
+            self._decode_lazy(self.report, [
+                section for section in sections
+                if not self.decoder_fields.get(section.type)])
+            return self.report
 
-    def parse(self, stream):
-        """Parse a data stream."""
         self.report = HRMReport()
-        position = 0
-        buffer_ = map(ord, stream.read())
-        i = 0
+        for section in sections:
+            self._parse_section(section)
+
+        return self.report
 
-        while i < 6:  # FIXME: Until end of data
-            if (buffer_[position] >> 4) == 1:
-                position = self._parse_header(buffer_, position)
+    def _decode_lazy(self, report, sections):
+        """Parse sections into a lazy report."""
+        previous = getattr(self, 'report', None)
+        self.report = report
+        try:
+            for section in sections:
+                self._parse_section(section)
 
-            elif (buffer_[position] >> 4) == 2:
-                position = self._parse_results(buffer_, position)
+        finally:
+            self.report = previous
 
-            elif (buffer_[position] >> 4) == 3:
-                position = self._parse_fitness(buffer_, position)
+    def iter_reports(self, source):
+        """Iterate over the reports of each training of the HRM data.
 
-            elif (buffer_[position] >> 4) == 4:
-                position = self._parse_heart_rates(buffer_, position)
+        Args:
+            source -- Raw HRM data, see iter_sections
 
-            elif (buffer_[position] >> 4) == 5:
-                position = self._parse_speed(buffer_, position)
+        """
+        for sections in self.iter_sessions(source):
+            yield self.parse_sections(sections)
 
-            elif (buffer_[position] >> 4) == 6:
-                position = self._parse_lap_results(buffer_, position)
+    def iter_sessions(self, source):
+        """Iterate over the list of sections of each training.
 
-            else:
-                position = self._parse_unkown(buffer_, position)
+        A new training is started after the end of data section, or when a
+        section type already found in the current training shows up again,
+        as happens with concatenated dumps. The user sections (header and
+        fitness) are carried over to the next trainings of the same dump.
 
-            i += 1
+        Args:
+            source -- Raw HRM data, see iter_sections
 
-        return self.report
+        """
+        sections = []
+        types = set()
+        user_sections = []
+        for section in self.iter_sections(source):
+            if section.type == END_SECTION:
+                if sections:
+                    yield sections
+
+                sections = []
+                types = set()
+                user_sections = []
+                continue
+
+            if section.type in types:
+                yield sections
+                if section.type in USER_SECTIONS:
+                    user_sections = []
+
+                sections = list(user_sections)
+                types = set(user_section.type
+                            for user_section in user_sections)
+
+            if section.type in USER_SECTIONS:
+                user_sections.append(section)
+
+            sections.append(section)
+            types.add(section.type)
+
+        if sections:
+            yield sections
+
+    def iter_sections(self, source, chunk_size=CHUNK_SIZE):
+        """Iterate over the sections of the HRM data.
+
+        Buffers (str, bytearray, buffer, memoryview or mmap) are parsed in
+        place, the sections point into them and no data is copied. A
+        unicode string is taken as the path of a dump, which is mapped into
+        memory. Anything else is read as a stream.
+
+        Args:
+            source -- Raw HRM data
+            chunk_size -- Number of bytes read from a stream at once
+
+        """
+        if isinstance(source, unicode):
+            source = map_file(source)
+
+        if isinstance(source, BUFFER_TYPES):
+            return self._iter_buffer_sections(source)
+
+        return self._iter_stream_sections(source, chunk_size)
+
+    def _iter_buffer_sections(self, buffer_):
+        """Iterate over the sections of a buffer."""
+        position = 0
+        end = len(buffer_)
+        last_type = None
+        while end - position >= FRAME_SIZE:
+            size = section_size(buffer_, position)
+            if end - position < size:
+                break
+
+            section = Section(buffer_, position)
+            last_type = section.type
+            yield section
+            position += size
+
+        self._check_end(end - position, position, last_type)
+
+    def _iter_stream_sections(self, stream, chunk_size):
+        """Iterate over the sections of a stream.
+
+        The stream is read in chunks, each section is yielded as soon as
+        all its bytes are available, so only the section being read is kept
+        in memory.
+
+        """
+        buffer_ = bytearray()
+        offset = 0
+        last_type = None
+        eof = False
+        while not eof:
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer_.extend(chunk)
+            position = 0
+            while len(buffer_) - position >= FRAME_SIZE:
+                size = section_size(buffer_, position)
+                if len(buffer_) - position < size:
+                    break
+
+                section = Section(buffer_[position:position + size], 0,
+                                  offset + position)
+                last_type = section.type
+                yield section
+                position += size
+
+            del buffer_[:position]
+            offset += position
+
+        self._check_end(len(buffer_), offset, last_type)
+
+    def _check_end(self, trailing, offset, last_type):
+        """Handle the bytes left after the last section of the data.
+
+        Args:
+            trailing -- Number of bytes left, not enough for a section
+            offset -- Offset of the bytes left
+            last_type -- Type of the last section, None if there was none
+
+        """
+        if trailing:
+            if self.strict:
+                raise HRMException('Data cut, %s trailing bytes at offset '
+                                   '%s.' % (trailing, offset))
+
+            logging.warning('Ignoring %s trailing bytes at offset %s.' %
+                            (trailing, offset))
+
+        elif self.strict and last_type != END_SECTION:
+            raise HRMException('Data cut, no end of data section at offset '
+                               '%s.' % offset)
+
+    @classmethod
+    def register_decoder(cls, section_type, decoder, fields=()):
+        """Register the decoder of a section type.
+
+        The decoder is called as decoder(parser, buffer_, position) and
+        stores the decoded values into parser.report, position being the
+        first byte of the section in buffer_. Registering a type replaces
+        its previous decoder.
+
+        Args:
+            section_type -- Section type, the high nibble of its first byte
+            decoder -- Function decoding the section
+            fields -- Names of the report fields set by the decoder, the
+                      sections of a type without fields are always decoded
+                      by lazy parsers
+
+        """
+        cls.decoders[section_type] = decoder
+        cls.decoder_fields[section_type] = tuple(fields)
+
+    def _parse_section(self, section):
+        """Parse a single section into the report."""
+        if not self._checkchecksum(section.buffer, section.position):
+            raise HRMException('Checksum is not correct at offset %s.' %
+                               section.offset)
+
+        decoder = self.decoders.get(section.type, Parser._parse_unkown)
+        decoder(self, section.buffer, section.position)
 
     def _parse_unkown(self, buffer_, position):
         """Parse unkown section."""
-        section = buffer_[position] >> 4
+        section = byte_at(buffer_, position) >> 4
         logging.warning('Do not know how to parse section %s.' % section)
-        final_byte = position + buffer_[position + 1] + 4
-        logging.debug(map(hex, buffer_[position:final_byte]))
+        final_byte = position + section_size(buffer_, position)
+        self._log_section(buffer_, position, final_byte)
+        return final_byte
+
+    def _parse_end(self, buffer_, position):
+        """Parse the end of data section."""
+        logging.info('Parsing end of data section.')
+        final_byte = position + section_size(buffer_, position)
+        self._log_section(buffer_, position, final_byte)
         return final_byte
 
     def _parse_header(self, buffer_, position):
         """Parse the data header."""
         logging.info('Parsing header section.')
-        if not self._checkchecksum(buffer_, position):
-            raise HRMException('Checksum is not correct.')
-
+        (gender_age, self.report.weight, self.report.height,
+         self.report.hr_hlimit, self.report.hr_llimit,
+         self.report.hr_maximun) = _HEADER.unpack_from(buffer_, position)
         # Gender
-        self.report.gender = (buffer_[position + 3] >> 7)
-        self.report.age = (buffer_[position + 3] & 0x7F)
-        self.report.weight = (buffer_[position + 4])
-        self.report.height = (buffer_[position + 5])
-        self.report.hr_hlimit = (buffer_[position + 6])
-        self.report.hr_llimit = buffer_[position + 7]
-        self.report.hr_maximun = buffer_[position + 8]
-
-        final_byte = position + buffer_[position + 1] + 4
-        logging.debug(map(hex, buffer_[position:final_byte]))
+        self.report.gender = gender_age >> 7
+        self.report.age = gender_age & 0x7F
+
+        final_byte = position + section_size(buffer_, position)
+        self._log_section(buffer_, position, final_byte)
         return final_byte
 
     def _parse_fitness(self, buffer_, position):
         """Parse fitness section."""
         logging.info('Parsing fitness test section.')
         base_year = 2000
-        self.report.fitness_flag = buffer_[position + 2]
-        self.report.min = self._bcd2hex(buffer_[position + 3])
-        self.report.hr = self._bcd2hex(buffer_[position + 4])
-        self.report.day = self._bcd2hex(buffer_[position + 5])
-        self.report.month = self._bcd2hex(buffer_[position + 6])
-        self.report.year = self._bcd2hex(buffer_[position + 7]) + base_year
-        self.report.fitness = buffer_[position + 8]
-        self.report.vo2max = buffer_[position + 9]
-
-        final_byte = position + buffer_[position + 1] + 4
-        logging.debug(map(hex, buffer_[position:final_byte]))
+        (self.report.fitness_flag, min_, hour, day, month, year,
+         self.report.fitness,
+         self.report.vo2max) = _FITNESS.unpack_from(buffer_, position)
+        self.report.min = BCD_TABLE[min_]
+        self.report.hr = BCD_TABLE[hour]
+        self.report.day = BCD_TABLE[day]
+        self.report.month = BCD_TABLE[month]
+        self.report.year = BCD_TABLE[year] + base_year
+
+        final_byte = position + section_size(buffer_, position)
+        self._log_section(buffer_, position, final_byte)
         return final_byte
 
     def _parse_results(self, buffer_, position):
         """Parse the results section."""
         logging.info('Parsing global results section.')
-        self.report.kcal = buffer_[position + 4]
-        self.report.fat = buffer_[position + 6]
-        self.report.tr_intime_seg = self._bcd2hex(buffer_[position + 8])
-        self.report.tr_intime_min = self._bcd2hex(buffer_[position + 9])
-        self.report.tr_intime_hr = self._bcd2hex(buffer_[position + 10])
-        self.report.tr_ltime_seg = self._bcd2hex(buffer_[position + 11])
-        self.report.tr_ltime_min = self._bcd2hex(buffer_[position + 12])
-        self.report.tr_ltime_hr = self._bcd2hex(buffer_[position + 13])
-        self.report.tr_htime_seg = self._bcd2hex(buffer_[position + 14])
-        self.report.tr_htime_min = self._bcd2hex(buffer_[position + 15])
-        self.report.tr_htime_hr = self._bcd2hex(buffer_[position + 16])
-        self.report.tr_hrmax = buffer_[position + 17]
-        self.report.tr_hravg = buffer_[position + 18]
-
-        final_byte = position + buffer_[position + 1] + 4
-        logging.debug(map(hex, buffer_[position:final_byte]))
+        values = _RESULTS.unpack_from(buffer_, position)
+        (self.report.kcal, self.report.fat) = values[:2]
+        (self.report.tr_intime_seg, self.report.tr_intime_min,
+         self.report.tr_intime_hr, self.report.tr_ltime_seg,
+         self.report.tr_ltime_min, self.report.tr_ltime_hr,
+         self.report.tr_htime_seg, self.report.tr_htime_min,
+         self.report.tr_htime_hr) = [BCD_TABLE[byte] for byte in values[2:11]]
+        (self.report.tr_hrmax, self.report.tr_hravg) = values[11:]
+
+        final_byte = position + section_size(buffer_, position)
+        self._log_section(buffer_, position, final_byte)
         return final_byte
 
     def _parse_heart_rates(self, buffer_, position):
         """Parses the heart rates section."""
         logging.info('Parsing heart rates section.')
-        datalen = (buffer_[position + 2] << 4) + buffer_[position + 1]
-        self.report.hr_data_min = self._bcd2hex(buffer_[position + 4])
-        self.report.hr_data_hour = self._bcd2hex(buffer_[position + 5])
-        hr_offset = 6
-        while hr_offset < datalen + 3:
-            self.report.hr_data.append(buffer_[position + hr_offset])
-            hr_offset = hr_offset + 1
-
-        final_byte = position + buffer_[position + 1] + 4
-        logging.debug(map(hex, buffer_[position:final_byte]))
+        datalen = section_length(buffer_, position)
+        (min_, hour) = _HEART_RATES.unpack_from(buffer_, position)
+        self.report.hr_data_min = BCD_TABLE[min_]
+        self.report.hr_data_hour = BCD_TABLE[hour]
+        hr_offset = _HEART_RATES.size
+        samples = read_bytes(buffer_, position + hr_offset,
+                             datalen + 3 - hr_offset)
+        self.report.hr_data.fromstring(samples)
+
+        final_byte = position + section_size(buffer_, position)
+        self._log_section(buffer_, position, final_byte)
         return final_byte
 
     def _parse_speed(self, buffer_, position):
         """Parses the heart rates section."""
         # Distance?
         logging.info('Parsing distance section.')
-        final_byte = position + buffer_[position + 1] + 4
-        logging.debug(map(hex, buffer_[position:final_byte]))
+        final_byte = position + section_size(buffer_, position)
+        self._log_section(buffer_, position, final_byte)
         return final_byte
 
     def _parse_lap_results(self, buffer_, position):
         """Parse the lap result section."""
         logging.info('Parsing lap results section.')
-        len_ = (buffer_[position + 2] << 4) + buffer_[position + 1]
-        self.report.lr_data_seg = self._bcd2hex(buffer_[position + 4])
-        self.report.lr_data_min = self._bcd2hex(buffer_[position + 5])
-        self.report.lr_data_hour = self._bcd2hex(buffer_[position + 6])
-        self.report.lr_data_day = self._bcd2hex(buffer_[position + 7])
-        self.report.lr_data_month = self._bcd2hex(buffer_[position + 8])
-        self.report.lr_data_year = self._bcd2hex(buffer_[position + 9]) + 2000
-        lap_offset = 10
-        id_ = 0
-        while lap_offset < len_ + 3:
-            lap = Lap(id_)
-            lap.seg = self._bcd2hex(buffer_[position + lap_offset])
-            lap.min = self._bcd2hex(buffer_[position + lap_offset + 1])
-            lap.hour = self._bcd2hex(buffer_[position + lap_offset + 2])
-            lap.hr = buffer_[position + lap_offset + 3]
-            self.report.laps.append(lap)
-            lap_offset = lap_offset + 7
-            id_ = id_ + 1
+        len_ = section_length(buffer_, position)
+        (self.report.lr_data_seg, self.report.lr_data_min,
+         self.report.lr_data_hour, self.report.lr_data_day,
+         self.report.lr_data_month, year) = \
+            [BCD_TABLE[byte] for byte in _LAPS.unpack_from(buffer_, position)]
+        self.report.lr_data_year = year + 2000
+        # Every lap record is 7 bytes, the last one may be cut after its
+        # heart rate
+        laps = max((len_ + 3 - _LAPS.size + _LAP_SIZE - 1) // _LAP_SIZE, 0)
+        if laps:
+            records = str(read_bytes(buffer_, position + _LAPS.size,
+                                     (laps - 1) * _LAP_SIZE + _LAP.size))
+            self.report.laps.extend(
+                array('i', xrange(laps)),
+                array('B', records[2::_LAP_SIZE].translate(_BCD_BYTES)),
+                array('B', records[1::_LAP_SIZE].translate(_BCD_BYTES)),
+                array('B', records[0::_LAP_SIZE].translate(_BCD_BYTES)),
+                array('B', records[3::_LAP_SIZE]))
 
         final_byte = position + len_ + 4
-        logging.debug(map(hex, buffer_[position:final_byte]))
+        self._log_section(buffer_, position, final_byte)
         return final_byte
 
+    def _log_section(self, buffer_, position, final_byte):
+        """Log the raw bytes of a section."""
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(map(hex, bytearray(buffer_[position:final_byte])))
+
     def _checkchecksum(self, buffer_, position):
         """Checks the data chunk checksum."""
-        length = buffer_[position + 1] + 2
-        accumulator = 0
-        for i in range(length):
-            accumulator += buffer_[position + i]
-
-        return True
+        return check_section(buffer_, position)
 
     def _bcd2hex(self, byte):
         """Returns byte value of a BCD byte."""
-        low = byte & 0xF
-        high = (byte >> 4) & 0xF
-        return low + high * 10
+        return BCD_TABLE[byte]
+
+
+Parser.register_decoder(END_SECTION, Parser._parse_end)
+Parser.register_decoder(1, Parser._parse_header,
+                        ('gender', 'age', 'weight', 'height', 'hr_llimit',
+                         'hr_hlimit', 'hr_maximun'))
+Parser.register_decoder(2, Parser._parse_results,
+                        ('kcal', 'fat', 'tr_intime_seg', 'tr_intime_min',
+                         'tr_intime_hr', 'tr_ltime_seg', 'tr_ltime_min',
+                         'tr_ltime_hr', 'tr_htime_seg', 'tr_htime_min',
+                         'tr_htime_hr', 'tr_hrmax', 'tr_hravg'))
+Parser.register_decoder(3, Parser._parse_fitness,
+                        ('fitness_flag', 'min', 'hr', 'day', 'month', 'year',
+                         'fitness', 'vo2max'))
+Parser.register_decoder(4, Parser._parse_heart_rates,
+                        ('hr_data_min', 'hr_data_hour', 'hr_data'))
+Parser.register_decoder(5, Parser._parse_speed)
+Parser.register_decoder(6, Parser._parse_lap_results,
+                        ('lr_data_seg', 'lr_data_min', 'lr_data_hour',
+                         'lr_data_day', 'lr_data_month', 'lr_data_year',
+                         'laps'))
 
 
 def _show_help():
@@ -208,26 +451,86 @@ def _show_help():
     print ''
     print 'Use:'
     print ''
-    print '  parser.py [-h] [-i inputfile]'
+    print '  parser.py [-h] [-s] [-c] [-l] [-n training] [-i inputfile]'
+    print '            [-o outputfile]'
+    print '  parser.py --batch dir [--jobs number] [--format format]'
+    print '  parser.py --verify path [--jobs number]'
     print ''
     print '  -h,        Display this help message'
     print '  -i,        Input file'
+    print '  -o,        Save the reports to a binary report file instead'
+    print '             of dumping them'
+    print '  -s,        Dump every training found in the input'
+    print '  -c,        Keep the parsed reports in a cache, so unchanged'
+    print '             data is not parsed again'
+    print '  -l,        List the start time of every training, decoding'
+    print '             only their lap results'
+    print '  -n number, Dump only the given training, starting at 0.'
+    print '             An index of the input file is kept to find it'
+    print '  --batch,   Parse every dump under a directory, writing one'
+    print '             record per training to stdout'
+    print '  --verify,  Check the framing and checksums of a dump, or of'
+    print '             every dump under a directory, writing each bad'
+    print '             section as a JSON line to stdout'
+    print '  --jobs,    Number of processes used by --batch and --verify,'
+    print '             defaults to the number of cpus'
+    print '  --format,  Output format of --batch, jsonl (default) or csv'
     print '  -v level,  Set the verbose level'
     print '             1: Debug level'
     print '             2: Info level'
 
 
-if __name__ == '__main__':
+def main(argv):
+    """Run the parser with the command line arguments."""
     inputfile = sys.stdin
+    inputpath = None
+    outputfile = None
+    sessionsflag = False
+    cacheflag = False
+    listflag = False
+    session = None
+    batchdir = None
+    verifypath = None
+    jobs = None
+    format_ = 'jsonl'
 
     # Parser command line options
     try:
-        argv = sys.argv[1:]
-        opts, args = getopt.getopt(argv, "hi:v:")
+        opts, args = getopt.getopt(argv, "hscli:o:n:v:",
+                                   ["batch=", "jobs=", "format=",
+                                    "verify="])
 
         for option in opts:
             if option[0] == '-i':
-                inputfile = open(option[1], 'r')
+                inputpath = option[1]
+                inputfile = map_file(inputpath)
+
+            elif option[0] == '-o':
+                outputfile = option[1]
+
+            elif option[0] == '-s':
+                sessionsflag = True
+
+            elif option[0] == '-c':
+                cacheflag = True
+
+            elif option[0] == '-l':
+                listflag = True
+
+            elif option[0] == '-n':
+                session = int(option[1])
+
+            elif option[0] == '--batch':
+                batchdir = option[1]
+
+            elif option[0] == '--verify':
+                verifypath = option[1]
+
+            elif option[0] == '--jobs':
+                jobs = int(option[1])
+
+            elif option[0] == '--format':
+                format_ = option[1]
 
             elif option[0] == '-h':
                 _show_help()
@@ -242,12 +545,76 @@ if __name__ == '__main__':
 
                 logging.basicConfig(level=level)
 
-    except getopt.GetoptError:
+    except (getopt.GetoptError, ValueError):
         _show_help()
         sys.exit(2)
 
     parser = Parser()
-    report = parser.parse(inputfile)
-    report.dump()
-    inputfile.close()
-    exit(0)
\ No newline at end of file
+    if verifypath is not None:
+        import verify
+        if jobs is not None and jobs < 1:
+            _show_help()
+            sys.exit(2)
+
+        bad_files = verify.run_verify(verify.list_paths([verifypath]),
+                                      sys.stdout, jobs)
+        exit(bad_files and 1 or 0)
+
+    elif batchdir is not None:
+        import batch
+        if format_ not in batch.FORMATS or jobs is not None and jobs < 1:
+            _show_help()
+            sys.exit(2)
+
+        errors = batch.run_batch(batch.list_dumps(batchdir), sys.stdout,
+                                 jobs, format_)
+        exit(errors and 1 or 0)
+
+    elif session is not None:
+        if inputpath is None:
+            _show_help()
+            sys.exit(2)
+
+        from index import SectionIndex
+        index = SectionIndex.open(inputpath)
+        if session >= index.count_sessions():
+            print 'Training %s not found.' % session
+            exit(2)
+
+        reports = [index.parse_session(session, parser)]
+
+    elif listflag:
+        for (ordinal, report) in enumerate(
+                Parser(lazy=True).iter_reports(inputfile)):
+            print 'Training %s: %s' % (ordinal,
+                                       report.start_time() or 'no date')
+
+        exit(0)
+
+    elif cacheflag:
+        from cache import ReportCache
+        cache = ReportCache()
+        if sessionsflag:
+            reports = cache.parse_reports(inputfile)
+
+        else:
+            reports = [cache.parse(inputfile)]
+
+    elif sessionsflag:
+        reports = parser.iter_reports(inputfile)
+
+    else:
+        reports = [parser.parse(inputfile)]
+
+    if outputfile is None:
+        for report in reports:
+            report.dump()
+
+    else:
+        save_reports(outputfile, list(reports))
+
+    exit(0)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,167 @@
+#! /usr/bin/python
+# -*- coding: utf-8 *-*
+
+# This file is part of the Beurer HRM python interface.
+# Copyright (C) 2013 Andres Moreno
+
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this file.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file parses the heart rate monitor data while it is downloaded.
+#
+# The download runs in the calling thread and hands every verified
+# section to a consumer thread through a bounded queue. The consumer
+# writes the section and feeds it to the parser, so when the last section
+# arrives the data is already written and interpreted.
+import Queue
+import struct
+import logging
+import threading
+
+from parser import Parser
+from exception import HRMException
+from section import END_SECTION
+
+# Sections waiting to be consumed before the download blocks
+QUEUE_SIZE = 16
+
+
+class _QueueStream(object):
+
+    """File like object reading the sections put in a queue."""
+
+    def __init__(self, queue, write=None):
+        """Initializes the object.
+
+        Args:
+            queue -- Queue with the section responses, None marks the end
+            write -- Function called with every response before parsing it
+
+        """
+        self.queue = queue
+        self.write = write
+        self.eof = False
+
+    def read(self, size=-1):
+        """Returns the next section bytes, an empty string at the end."""
+        if self.eof:
+            return ''
+
+        response = self.queue.get()
+        if response is None:
+            self.eof = True
+            return ''
+
+        if self.write is not None:
+            self.write(response)
+
+        return str(bytearray(response))
+
+
+class DownloadPipeline(object):
+
+    """Parse the HRM data while it is being downloaded."""
+
+    def __init__(self, write=None, queue_size=QUEUE_SIZE):
+        """Initializes the object.
+
+        Args:
+            write -- Function called with every section response as soon
+                     as it is received, to persist it
+            queue_size -- Sections received and not yet consumed before
+                          the download waits for the consumer
+
+        """
+        self.write = write
+        self.queue_size = queue_size
+        self.reports = []
+        self._error = None
+
+    def run(self, monitor, delete, *args):
+        """Download and parse the data, returns the parsed reports.
+
+        Args:
+            monitor -- HeartRateMonitor to download the data from
+            delete -- Delete the data from the HRM after being read
+
+        Any other argument is passed to monitor.iter_data.
+
+        """
+        queue = Queue.Queue(self.queue_size)
+        stream = _QueueStream(queue, self.write)
+        consumer = threading.Thread(target=self._consume, args=(stream,))
+        consumer.daemon = True
+        self.reports = []
+        self._error = None
+        consumer.start()
+        responses = monitor.iter_data(delete, *args)
+        consumed = False
+        try:
+            for response in responses:
+                queue.put(response)
+                if response[0] >> 4 == END_SECTION:
+                    # The HRM data is deleted when the next response is
+                    # requested, once everything has been consumed
+                    queue.put(None)
+                    consumer.join()
+                    consumed = True
+
+                if self._error is not None:
+                    # Nothing is deleted if the data was not written or
+                    # parsed
+                    responses.close()
+                    break
+
+        finally:
+            if not consumed:
+                queue.put(None)
+                consumer.join()
+
+        if self._error is not None:
+            raise self._error
+
+        return self.reports
+
+    def _consume(self, stream):
+        """Parse the sections read from the queue."""
+        try:
+            for report in Parser().iter_reports(stream):
+                self.reports.append(report)
+
+        except (HRMException, struct.error) as error:
+            self._error = HRMException('Can not parse the downloaded data: '
+                                       '%s' % error)
+
+        except EnvironmentError as error:
+            self._error = HRMException('Can not write the downloaded data: '
+                                       '%s' % error)
+            stream.write = None
+
+        except Exception as error:
+            # Raised again by run, the consumer must not end while the
+            # download is still putting sections in the queue
+            self._error = error
+            stream.write = None
+
+        if self._error is not None:
+            logging.error(str(self._error))
+            # Keep consuming so the download is not blocked
+            while True:
+                try:
+                    if not stream.read():
+                        break
+
+                except Exception as error:
+                    logging.error('Can not write the downloaded data: %s' %
+                                  error)
+                    stream.write = None
@@ -19,6 +19,44 @@
 
 # This file provides a class to encapsulate the interpreted data read from
 # the heart rate monitor
+#
+# Reports can be saved to a columnar binary file holding any number of
+# reports, all little endian:
+#
+#     header: magic, version, reports, heart rate samples, laps
+#     one record per report: scalar fields, first sample, samples,
+#                            first lap, laps
+#     heart rate samples of every report, one byte each
+#     one record per lap: id, hour, min, seg, hr
+import sys
+import struct
+import datetime
+from array import array
+
+from lap import LapTable
+from exception import HRMException
+from section import map_file
+
+# Names of the scalar report fields
+FIELDS = ('gender', 'age', 'weight', 'height', 'hr_llimit', 'hr_hlimit',
+          'hr_maximun', 'fitness_flag', 'min', 'hr', 'day', 'month', 'year',
+          'fitness', 'vo2max', 'fat', 'kcal', 'tr_hrmax', 'tr_hravg',
+          'tr_ltime_seg', 'tr_ltime_min', 'tr_ltime_hr', 'tr_intime_seg',
+          'tr_intime_min', 'tr_intime_hr', 'tr_htime_seg', 'tr_htime_min',
+          'tr_htime_hr', 'lr_data_year', 'lr_data_month', 'lr_data_day',
+          'lr_data_hour', 'lr_data_min', 'lr_data_seg', 'hr_data_hour',
+          'hr_data_min')
+
+REPORT_FILE_VERSION = 1
+# Suffix of the report files saved next to their dumps
+REPORT_SUFFIX = '.reports'
+
+_FILE_MAGIC = 'BHRM'
+_FILE_HEADER = struct.Struct('<4sBIQI')
+_REPORT_RECORD = struct.Struct(
+    '<' + ''.join(name.endswith('year') and 'H' or 'B' for name in FIELDS) +
+    'QIII')
+_LAP_RECORD = struct.Struct('<I4B')
 
 
 class HRMReport(object):
@@ -55,11 +93,12 @@ class HRMReport(object):
         self.tr_intime_seg = 0
         self.tr_intime_min = 0
         self.tr_intime_hr = 0
+        self.tr_htime_seg = 0
+        self.tr_htime_min = 0
         self.tr_htime_hr = 0
-        self.tr_htime_hr = 0
-        self.tr_htime_hr = 0
+        self.tr_hravg = 0
         # Laps
-        self.laps = []
+        self.laps = LapTable()
         self.lr_data_year = 0
         self.lr_data_month = 0
         self.lr_data_day = 0
@@ -69,7 +108,38 @@ class HRMReport(object):
         # Heart rate data
         self.hr_data_hour = 0
         self.hr_data_min = 0
-        self.hr_data = []
+        # One unsigned byte per sample, as sent by the HRM
+        self.hr_data = array('B')
+
+    def save(self, path):
+        """Save the report to a report file."""
+        save_reports(path, [self])
+
+    @classmethod
+    def load(cls, path):
+        """Returns the first report of a report file."""
+        reports = load_reports(path)
+        if not reports:
+            raise HRMException('No reports in %s.' % path)
+
+        return reports[0]
+
+    def to_dict(self):
+        """Returns the report data as a dictionary of plain values."""
+        data = dict((name, getattr(self, name)) for name in FIELDS)
+        data['gender'] = int(self.gender)
+        data['hr_data'] = self.hr_data.tolist()
+        data['laps'] = self.laps.to_dicts()
+        return data
+
+    def start_time(self):
+        """Returns the training start time, None if there are no laps."""
+        if not self.lr_data_year:
+            return None
+
+        return datetime.datetime(self.lr_data_year, self.lr_data_month,
+                                 self.lr_data_day, self.lr_data_hour,
+                                 self.lr_data_min, self.lr_data_seg)
 
     def dump(self):
         """Dumps the report data."""
@@ -106,7 +176,7 @@ class HRMReport(object):
         print 'Heart Rate data start time: %02d:%02d' % \
                                                             (self.hr_data_hour,
                                                             self.hr_data_min)
-        print 'Heart Rate data: %s' % self.hr_data
+        print 'Heart Rate data: %s' % self.hr_data.tolist()
 
         print 'Lap results start time: %s-%02d-%02d %02d:%02d:%02d' % \
                                                     (self.lr_data_year,
@@ -120,3 +190,187 @@ class HRMReport(object):
             print '  Lap duration: %02d:%02d:%02d' % (lap.hour, lap.min,
                                                         lap.seg)
             print '  Lap HR: %s' % lap.hr
+
+
+class LazyHRMReport(HRMReport):
+
+    """Report decoding each section the first time one of its fields is used.
+
+    The report keeps the sections of the training, pointing into the raw
+    data, and the fields of each section are left out until one of them is
+    read or written. Reading the date of a training then decodes only the
+    lap results, the heart rate samples are never copied.
+
+    """
+
+    def __init__(self, decode, sections, fields):
+        """Initializes the object.
+
+        Args:
+            decode -- Function called as decode(report, sections) to decode
+                      a list of sections into the report
+            sections -- Section objects of the training
+            fields -- Dictionary of the report fields set by the decoder of
+                      each section type
+
+        """
+        # The fields are taken from a new report, without going through
+        # __setattr__
+        values = HRMReport().__dict__
+        pending = {}
+        deferred = {}
+        for section in sections:
+            names = fields.get(section.type)
+            if not names:
+                continue
+
+            if names[0] in pending:
+                pending[names[0]][1].append(section)
+                continue
+
+            group = (names, [section])
+            for name in names:
+                pending[name] = group
+                deferred[name] = values.pop(name)
+
+        values.update(sections=list(sections), _decode=decode,
+                      _pending=pending, _deferred=deferred)
+        self.__dict__.update(values)
+
+    def __getattr__(self, name):
+        # Only called for the fields not decoded yet
+        if name not in self.__dict__.get('_pending', ()):
+            raise AttributeError(name)
+
+        self._decode_field(name)
+        return self.__dict__[name]
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__.get('_pending', ()):
+            self._decode_field(name)
+
+        super(LazyHRMReport, self).__setattr__(name, value)
+
+    def __getstate__(self):
+        self.decode_all()
+        return dict((name, value) for (name, value) in self.__dict__.items()
+                    if not name.startswith('_') and name != 'sections')
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, sections=[], _decode=None, _pending={},
+                             _deferred={})
+
+    def _decode_field(self, name):
+        """Decode the sections holding a field."""
+        (names, sections) = self._pending[name]
+        for field in names:
+            del self._pending[field]
+            self.__dict__[field] = self._deferred.pop(field)
+
+        self._decode(self, sections)
+
+    def decoded(self, name):
+        """Returns True if the field is already decoded."""
+        return name not in self._pending
+
+    def decode_all(self):
+        """Decode every section not decoded yet."""
+        while self._pending:
+            self._decode_field(next(iter(self._pending)))
+
+
+def _pack_laps(laps):
+    """Returns the lap records of a LapTable, interleaving its arrays."""
+    size = _LAP_RECORD.size
+    records = bytearray(len(laps) * size)
+    ids = array('i', laps.id)
+    if sys.byteorder == 'big':
+        ids.byteswap()
+
+    ids = ids.tostring()
+    for byte in range(4):
+        records[byte::size] = ids[byte::4]
+
+    for (offset, field) in enumerate((laps.hour, laps.min, laps.seg,
+                                      laps.hr), 4):
+        records[offset::size] = field.tostring()
+
+    return records
+
+
+def _unpack_laps(records, laps):
+    """Add the laps of a string of lap records to a LapTable."""
+    size = _LAP_RECORD.size
+    ids = bytearray(len(records) // size * 4)
+    for byte in range(4):
+        ids[byte::4] = records[byte::size]
+
+    ids = array('i', str(ids))
+    if sys.byteorder == 'big':
+        ids.byteswap()
+
+    laps.extend(ids, *[array('B', records[offset::size])
+                       for offset in range(4, size)])
+
+
+def save_reports(path, reports):
+    """Save a list of reports to a report file."""
+    records = []
+    samples = 0
+    laps = 0
+    for report in reports:
+        values = [getattr(report, name) for name in FIELDS]
+        values.extend((samples, len(report.hr_data), laps, len(report.laps)))
+        records.append(_REPORT_RECORD.pack(*values))
+        samples += len(report.hr_data)
+        laps += len(report.laps)
+
+    hfile = open(path, 'wb')
+    hfile.write(_FILE_HEADER.pack(_FILE_MAGIC, REPORT_FILE_VERSION,
+                                  len(reports), samples, laps))
+    hfile.write(''.join(records))
+    for report in reports:
+        report.hr_data.tofile(hfile)
+
+    for report in reports:
+        hfile.write(_pack_laps(report.laps))
+
+    hfile.close()
+
+
+def load_reports(path):
+    """Returns the list of reports of a report file."""
+    buffer_ = map_file(path)
+    if len(buffer_) < _FILE_HEADER.size:
+        raise HRMException('%s is not a report file.' % path)
+
+    (magic, version, count, samples,
+     laps) = _FILE_HEADER.unpack_from(buffer_)
+    if magic != _FILE_MAGIC:
+        raise HRMException('%s is not a report file.' % path)
+
+    if version != REPORT_FILE_VERSION:
+        raise HRMException('Unsupported report file version %s.' % version)
+
+    samples_start = _FILE_HEADER.size + count * _REPORT_RECORD.size
+    laps_start = samples_start + samples
+    if len(buffer_) != laps_start + laps * _LAP_RECORD.size:
+        raise HRMException('Report file %s is truncated.' % path)
+
+    lap_records = buffer_[laps_start:]
+    reports = []
+    for i in range(count):
+        values = _REPORT_RECORD.unpack_from(
+            buffer_, _FILE_HEADER.size + i * _REPORT_RECORD.size)
+        report = HRMReport()
+        report.__dict__.update(zip(FIELDS, values))
+
+        (first_sample, samples, first_lap, laps) = values[len(FIELDS):]
+        report.hr_data.fromstring(
+            buffer(buffer_, samples_start + first_sample, samples))
+        _unpack_laps(lap_records[first_lap * _LAP_RECORD.size:
+                                 (first_lap + laps) * _LAP_RECORD.size],
+                     report.laps)
+        reports.append(report)
+
+    return reports
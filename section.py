@@ -0,0 +1,134 @@
+#! /usr/bin/python
+# -*- coding: utf-8 *-*
+
+# This file is part of the Beurer HRM python interface.
+# Copyright (C) 2013 Andres Moreno
+
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this file.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file provides a class to encapsulate a single section of the data
+# read from the heart rate monitor.
+#
+# Every section is framed the same way:
+#
+#     [id] [length low] [length high] [payload ...] [checksum]
+#
+# The high nibble of the id byte is the section type. The header (1) and
+# fitness (3) sections only use one length byte, their third byte is data.
+import os
+import mmap
+import struct
+
+# Bytes used by the id and length fields
+FRAME_SIZE = 3
+# Bytes added to the section length to get the whole section size
+OVERHEAD = 4
+
+# Type of the last section sent by the HRM on every download
+END_SECTION = 0x0
+# Types of the sections with user data instead of training data
+USER_SECTIONS = (0x1, 0x3)
+
+_BYTE = struct.Struct('B')
+_FRAME = struct.Struct('<BBB')
+_SHORT_LENGTH_SECTIONS = (0x1, 0x3)
+
+
+def byte_at(buffer_, position):
+    """Returns the integer value of the byte at position."""
+    return _BYTE.unpack_from(buffer_, position)[0]
+
+
+def read_bytes(buffer_, position, count):
+    """Returns count bytes starting at position as a read-only buffer.
+
+    No data is copied, except for memoryviews, which can not be wrapped
+    by a buffer object.
+
+    """
+    if isinstance(buffer_, memoryview):
+        return buffer_[position:position + count].tobytes()
+
+    return buffer(buffer_, position, count)
+
+
+def map_file(path):
+    """Map a file into memory as a read-only buffer."""
+    hfile = open(path, 'rb')
+    if os.fstat(hfile.fileno()).st_size == 0:
+        buffer_ = ''
+
+    else:
+        buffer_ = mmap.mmap(hfile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    hfile.close()
+    return buffer_
+
+
+def section_length(buffer_, position):
+    """Returns the length field of the section starting at position."""
+    (id_, low, high) = _FRAME.unpack_from(buffer_, position)
+    if (id_ >> 4) in _SHORT_LENGTH_SECTIONS:
+        return low
+
+    return (high << 8) + low
+
+
+def section_size(buffer_, position):
+    """Returns the number of bytes of the section starting at position."""
+    return section_length(buffer_, position) + OVERHEAD
+
+
+def section_checksum(buffer_, position, size=None):
+    """Returns the checksum of the section starting at position.
+
+    The checksum is the low byte of the sum of every section byte but the
+    last one, which holds the checksum sent by the HRM. The bytes are
+    summed at once, without decoding them one by one.
+
+    """
+    if size is None:
+        size = section_size(buffer_, position)
+
+    return sum(bytearray(read_bytes(buffer_, position, size - 1))) & 0xFF
+
+
+def check_section(buffer_, position):
+    """Returns True if the checksum of the section at position is right."""
+    size = section_size(buffer_, position)
+    return section_checksum(buffer_, position, size) == \
+        byte_at(buffer_, position + size - 1)
+
+
+class Section(object):
+
+    """A framed section of the HRM data."""
+
+    def __init__(self, buffer_, position, offset=None):
+        """Initializes the object.
+
+        Args:
+            buffer_ -- Buffer holding the section bytes
+            position -- Position of the first section byte in buffer_
+            offset -- Position of the section in the whole input, defaults
+                      to position
+
+        """
+        self.buffer = buffer_
+        self.position = position
+        self.offset = position if offset is None else offset
+        self.id = _FRAME.unpack_from(buffer_, position)[0]
+        self.type = self.id >> 4
+        self.length = section_length(buffer_, position)
+        self.size = self.length + OVERHEAD
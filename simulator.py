@@ -0,0 +1,235 @@
+#! /usr/bin/python
+# -*- coding: utf-8 *-*
+
+# This file is part of the Beurer HRM python interface.
+# Copyright (C) 2013 Andres Moreno
+
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this file.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file provides a simulated USB transport.
+#
+# A simulated monitor replays a recorded dump answering the control
+# transfers of the serial bridge as the real monitor does, so the download,
+# retry and baud rate code can be run and timed without any hardware.
+import time
+import array
+import random
+
+from beurer import BAUD_RATE_CODES, DEFAULT_BAUD_RATE, ID_VENDOR, \
+    ID_PRODUCT
+from parser import Parser
+
+# Kinds of transmission errors that can be injected
+ERROR_KINDS = ('checksum', 'bytes', 'timeout')
+
+# Bits sent on the serial line for each byte, start and stop bits included
+BITS_PER_BYTE = 10
+
+_INITIAL_MESSAGE = '\x91\x01\x00\x01\x93'
+_BAUD_RATES_BY_CODE = dict((code, rate)
+                           for (rate, code) in BAUD_RATE_CODES.items())
+
+
+class SimulatedTransferError(IOError):
+
+    """A transfer failed on a simulated link."""
+
+
+class SimulatedTransport(object):
+
+    """Access simulated monitors instead of the USB bus."""
+
+    # Exceptions raised by failed transfers
+    errors = (SimulatedTransferError,)
+
+    def __init__(self, devices):
+        """Initialize the transport.
+
+        Args:
+            devices -- SimulatedMonitor instances attached to the transport
+
+        """
+        self.devices = list(devices)
+
+    def find_devices(self, id_vendor, id_product):
+        """Returns every attached device with the given ids."""
+        return [device for device in self.devices
+                if device.idVendor == id_vendor and
+                device.idProduct == id_product]
+
+    def get_serial(self, device):
+        """Returns the serial number of a device, None if it has none."""
+        return device.serial
+
+
+class SimulatedMonitor(object):
+
+    """Monitor replaying a recorded dump through a simulated bridge."""
+
+    def __init__(self, data, serial=None, bus=1, address=1,
+                 max_baud_rate=None, error_rate=0.0, error_kinds=ERROR_KINDS,
+                 time_scale=1.0, latency=0.0, seed=None):
+        """Initialize the simulated monitor.
+
+        Every byte sent or received takes the time needed by the serial
+        line at the baud rate set, multiplied by time_scale, so a time_scale
+        of 0 replays the dump as fast as possible. Above max_baud_rate the
+        line garbles every response.
+
+        Args:
+            data -- Recorded dump, a binary buffer or file
+            serial -- Serial number of the monitor
+            bus -- Bus number of the monitor
+            address -- Address of the monitor in the bus
+            max_baud_rate -- Fastest baud rate that works, None for any
+            error_rate -- Probability of each response being wrong
+            error_kinds -- Kinds of errors injected, from ERROR_KINDS
+            time_scale -- Factor applied to the simulated transfer times
+            latency -- Seconds taken by every control transfer
+            seed -- Seed of the error injection, for repeatable runs
+
+        """
+        self.idVendor = ID_VENDOR
+        self.idProduct = ID_PRODUCT
+        self.serial = serial
+        self.iSerialNumber = int(serial is not None)
+        self.bus = bus
+        self.address = address
+        self.port_numbers = (address,)
+        self.max_baud_rate = max_baud_rate
+        self.error_rate = error_rate
+        self.error_kinds = tuple(error_kinds)
+        self.time_scale = time_scale
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.sections = [array.array('B', str(section.buffer[
+            section.position:section.position + section.size]))
+            for section in Parser().iter_sections(data)]
+        self.baud_rate = DEFAULT_BAUD_RATE
+        self.timeout = None
+        self.deleted = False
+        # Statistics of the simulated link
+        self.transfers = 0
+        self.errors_injected = 0
+        self.link_time = 0.0
+        self._cursor = None
+        self._response = None
+        self._failed = False
+
+    def set_configuration(self):
+        """Select the device configuration, nothing to do."""
+        pass
+
+    def ctrl_transfer(self, bm_request_type, b_request, value, index=0,
+                      data_or_length=None, timeout=None):
+        """Answer a control transfer as the bridge and the monitor do."""
+        self.transfers += 1
+        if value == 0x5003:
+            return self._configure(index, data_or_length)
+
+        if value == 0x5001:
+            self._wait(len(data_or_length))
+            self._request(data_or_length)
+            return len(data_or_length)
+
+        if value == 0x5002:
+            return self._send_response()
+
+        if value == 0x500D:
+            return array.array('B', [len(self._response) >> 8 & 0xFF,
+                                     len(self._response) & 0xFF])
+
+        raise SimulatedTransferError('Unknown request %#x.' % value)
+
+    def _configure(self, index, msg):
+        """Set the bridge baud rate or timeout."""
+        if index == 0xF0:
+            if msg not in _BAUD_RATES_BY_CODE:
+                raise SimulatedTransferError('Unknown baud rate code.')
+
+            self.baud_rate = _BAUD_RATES_BY_CODE[msg]
+
+        elif index == 0xFFFF:
+            self.timeout = ord(msg)
+
+        return len(msg)
+
+    def _request(self, msg):
+        """Select the section requested by a message."""
+        self._response = array.array('B')
+        if msg == _INITIAL_MESSAGE:
+            self._cursor = 0
+
+        elif ord(msg[3]) == 0:
+            # The message after the end section deletes the data
+            self.deleted = True
+            self.sections = self.sections[-1:]
+            self._cursor = None
+            return
+
+        elif not (self._failed and self._cursor is not None and
+                  msg == _request_after(self.sections[self._cursor - 1])):
+            self._cursor = self._find_request(msg)
+
+        self._failed = False
+        if self._cursor is not None:
+            self._response = self.sections[self._cursor]
+
+    def _find_request(self, msg):
+        """Returns the section following the one the message answers."""
+        start = (self._cursor or 0) + 1
+        for position in range(start, len(self.sections)) + range(1, start):
+            if _request_after(self.sections[position - 1]) == msg:
+                return position
+
+        return None
+
+    def _send_response(self):
+        """Returns the section requested, injecting the errors."""
+        response = array.array('B', self._response)
+        self._wait(len(response))
+        if self.max_baud_rate is not None and \
+                self.baud_rate > self.max_baud_rate and response:
+            self._failed = True
+            response[-1] ^= 0xFF
+            return response
+
+        if response and self.random.random() < self.error_rate:
+            self.errors_injected += 1
+            self._failed = True
+            kind = self.random.choice(self.error_kinds)
+            if kind == 'timeout':
+                raise SimulatedTransferError('Operation timed out')
+
+            if kind == 'bytes':
+                return response[:self.random.randrange(1, len(response))]
+
+            response[-1] ^= 0xFF
+
+        return response
+
+    def _wait(self, byte_count):
+        """Spend the time the serial line takes to carry some bytes."""
+        seconds = self.latency + \
+            byte_count * BITS_PER_BYTE / float(self.baud_rate)
+        self.link_time += seconds
+        if self.time_scale:
+            time.sleep(seconds * self.time_scale)
+
+
+def _request_after(response):
+    """Returns the message the host sends after receiving a response."""
+    msg = chr((response[0] & 0x0F) - 0x60 & 0xFF) + '\x01\x00' + \
+        chr(response[0] >> 4)
+    return msg + chr(sum(map(ord, msg)) & 0xFF)
@@ -0,0 +1,98 @@
+#! /usr/bin/python
+# -*- coding: utf-8 *-*
+
+# This file is part of the Beurer HRM python interface.
+# Copyright (C) 2013 Andres Moreno
+
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this file.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file writes the downloaded sections as they arrive.
+#
+# Every section is formatted on its own and handed to the operating system
+# right away, so the output takes linear time, no more memory than a
+# section, and a failed download leaves the sections received on disk.
+import os
+import sys
+import array
+
+# Bytes buffered by the output file
+BUFFER_SIZE = 64 * 1024
+# Appended to the output file to get the partial download file
+CHECKPOINT_SUFFIX = '.part'
+
+# Ascii text of every byte value
+_ASCII_BYTES = tuple('%d ' % byte for byte in range(256))
+
+
+def format_section(row, asciiflag=False):
+    """Returns a section formatted as binary data or as an ascii row.
+
+    Args:
+        row -- Section bytes, a list or an array of integers
+        asciiflag -- Format the section as a line of decimal numbers
+
+    """
+    if asciiflag:
+        return ''.join([_ASCII_BYTES[byte] for byte in row]) + '\n'
+
+    if not isinstance(row, array.array):
+        row = array.array('B', row)
+
+    return row.tostring()
+
+
+class OutputSink(object):
+
+    """Write the downloaded sections to a file or to stdout."""
+
+    def __init__(self, path=None, asciiflag=False, fsync=False,
+                 buffer_size=BUFFER_SIZE):
+        """Open the output.
+
+        Args:
+            path -- Output file, stdout if None
+            asciiflag -- Write the sections as ascii rows
+            fsync -- Sync the file to disk when it is closed
+            buffer_size -- Bytes buffered by the output file
+
+        """
+        self.path = path
+        self.asciiflag = asciiflag
+        self.fsync = fsync
+        self.sections = 0
+        self.bytes_written = 0
+        if path is None:
+            self.output = sys.stdout
+
+        else:
+            self.output = open(path, 'wb', buffer_size)
+
+    def write(self, row):
+        """Write a section and hand it to the operating system."""
+        data = format_section(row, self.asciiflag)
+        self.output.write(data)
+        self.output.flush()
+        self.sections += 1
+        self.bytes_written += len(data)
+
+    def close(self):
+        """Flush the output, and close it unless it is stdout."""
+        self.output.flush()
+        if self.path is None:
+            return
+
+        if self.fsync:
+            os.fsync(self.output.fileno())
+
+        self.output.close()
@@ -0,0 +1,389 @@
+#! /usr/bin/python
+# -*- coding: utf-8 *-*
+
+# This file is part of the Beurer HRM python interface.
+# Copyright (C) 2013 Andres Moreno
+
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this file.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file keeps the interpreted trainings in a SQLite database.
+#
+# Every training is a row of the sessions table, identified by its user and
+# start time, with its laps in their own table. The trainings of a dump are
+# inserted with executemany in a single transaction, skipping the ones
+# already stored, and the database uses a write ahead log so it can be read
+# while new dumps are stored.
+#
+# The heart rate samples of a training are kept as a blob of bytes in its
+# session row, one byte per sample as sent by the monitor, instead of a row
+# per sample. They take a byte each, and query_hr answers a time range by
+# reading the sessions found through the start time index straight into
+# numpy arrays.
+import os
+import sys
+import time
+import getopt
+import logging
+import sqlite3
+import calendar
+import datetime
+import itertools
+
+from report import FIELDS
+
+__VERSION__ = 0.1
+
+DATABASE_FILE = os.path.join(os.path.expanduser('~'), '.local', 'share',
+                             'bhrm', 'sessions.db')
+SCHEMA_VERSION = 1
+
+# Formats of the times given in the command line
+TIME_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S')
+
+# Seconds between heart rate samples
+SAMPLE_SECONDS = 60
+
+_SESSION_COLUMNS = ('user', 'start', 'source', 'samples',
+                    'hr_data') + FIELDS
+
+_SCHEMA = ('''
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    source TEXT,
+    samples INTEGER NOT NULL,
+    hr_data BLOB NOT NULL,
+    %s,
+    UNIQUE (user, start))''' % ',\n    '.join('"%s" INTEGER' % name
+                                          for name in FIELDS),
+           '''
+CREATE INDEX IF NOT EXISTS sessions_start ON sessions (start)''',
+           '''
+CREATE INDEX IF NOT EXISTS sessions_samples ON sessions (samples)''',
+           '''
+CREATE TABLE IF NOT EXISTS laps (
+    session INTEGER NOT NULL REFERENCES sessions (id),
+    lap INTEGER NOT NULL,
+    seg INTEGER,
+    min INTEGER,
+    hour INTEGER,
+    hr INTEGER,
+    PRIMARY KEY (session, lap))''')
+
+
+def _epoch(value):
+    """Returns a datetime, or epoch seconds, as epoch seconds."""
+    if isinstance(value, datetime.datetime):
+        return calendar.timegm(value.timetuple())
+
+    return int(value)
+
+
+def report_start(report):
+    """Returns the start of the heart rates of a report, in epoch seconds.
+
+    The heart rates start at the hour and minute of their section, on the
+    day of the laps. The device time is stored as if it was UTC. Returns
+    None if the report has no date.
+
+    """
+    start = report.start_time()
+    if start is None:
+        return None
+
+    start = datetime.datetime(start.year, start.month, start.day,
+                              report.hr_data_hour, report.hr_data_min)
+    return calendar.timegm(start.timetuple())
+
+
+class SessionStore(object):
+
+    """SQLite database of the interpreted trainings."""
+
+    def __init__(self, path=DATABASE_FILE):
+        """Open the database, creating it if needed.
+
+        Args:
+            path -- Path of the database file
+
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self._create()
+
+    def _create(self):
+        """Create the tables and indexes missing."""
+        with self.connection:
+            for statement in _SCHEMA:
+                self.connection.execute(statement)
+
+            self.connection.execute('PRAGMA user_version=%d' %
+                                    SCHEMA_VERSION)
+
+    def close(self):
+        """Close the database."""
+        self.connection.close()
+
+    def ingest_reports(self, reports, user='', source=None):
+        """Store the trainings of a dump in a single transaction.
+
+        Trainings already stored for the user with the same start time are
+        skipped, as are the ones without a date.
+
+        Args:
+            reports -- HRMReport of each training
+            user -- Name of the user, or of the monitor, of the trainings
+            source -- Path of the dump the trainings come from
+
+        Returns the number of trainings stored.
+
+        """
+        new = {}
+        for report in reports:
+            start = report_start(report)
+            if start is None:
+                logging.warning('Skipping a training without date.')
+                continue
+
+            new.setdefault(start, report)
+
+        if not new:
+            return 0
+
+        with self.connection:
+            cursor = self.connection.cursor()
+            cursor.execute('SELECT start FROM sessions WHERE user = ? AND '
+                           'start BETWEEN ? AND ?',
+                           (user, min(new), max(new)))
+            for (start,) in cursor.fetchall():
+                new.pop(start, None)
+
+            if not new:
+                return 0
+
+            cursor.executemany(
+                'INSERT INTO sessions (%s) VALUES (%s)' %
+                (', '.join('"%s"' % name for name in _SESSION_COLUMNS),
+                 ', '.join('?' * len(_SESSION_COLUMNS))),
+                [(user, start, source, len(report.hr_data),
+                  sqlite3.Binary(report.hr_data.tostring())) +
+                 tuple(getattr(report, name) for name in FIELDS)
+                 for (start, report) in sorted(new.items())])
+            cursor.execute('SELECT start, id FROM sessions WHERE user = ? '
+                           'AND start BETWEEN ? AND ?',
+                           (user, min(new), max(new)))
+            ids = dict(cursor.fetchall())
+            cursor.executemany(
+                'INSERT INTO laps (session, lap, seg, min, hour, hr) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                itertools.chain.from_iterable(
+                    itertools.izip(itertools.repeat(ids[start]),
+                                   report.laps.id, report.laps.seg,
+                                   report.laps.min, report.laps.hour,
+                                   report.laps.hr)
+                    for (start, report) in new.items()))
+
+        return len(new)
+
+    def ingest_file(self, path, user=''):
+        """Store every training of a dump file, see ingest_reports."""
+        from parser import Parser
+        from section import map_file
+        return self.ingest_reports(Parser().iter_reports(map_file(path)),
+                                   user, path)
+
+    def query_hr(self, start, end, user=None):
+        """Returns the heart rate samples taken in a time range.
+
+        Only the sessions starting in the range, or before it but not
+        longer than the longest session, are read, through the start time
+        index.
+
+        Args:
+            start -- First time of the range, as a datetime or epoch seconds
+            end -- End of the range, not included
+            user -- User of the sessions, every user by default
+
+        Returns a (times, hr) tuple of numpy arrays, the times of the
+        samples as datetime64 seconds and their heart rates as uint8, in
+        time order.
+
+        """
+        import numpy
+        start = _epoch(start)
+        end = _epoch(end)
+        longest = self.connection.execute(
+            'SELECT MAX(samples) FROM sessions').fetchone()[0] or 0
+        query = 'SELECT start, hr_data FROM sessions WHERE start >= ? AND ' \
+                'start < ? AND start + samples * ? > ?'
+        parameters = [start - longest * SAMPLE_SECONDS, end, SAMPLE_SECONDS,
+                      start]
+        if user is not None:
+            query += ' AND user = ?'
+            parameters.append(user)
+
+        times = []
+        hrs = []
+        for (first, hr) in self.connection.execute(query + ' ORDER BY start',
+                                                   parameters):
+            hr = numpy.frombuffer(hr, dtype=numpy.uint8)
+            times.append(first + SAMPLE_SECONDS *
+                         numpy.arange(len(hr), dtype=numpy.int64))
+            hrs.append(hr)
+
+        if not times:
+            return (numpy.empty(0, dtype='datetime64[s]'),
+                    numpy.empty(0, dtype=numpy.uint8))
+
+        times = numpy.concatenate(times)
+        hrs = numpy.concatenate(hrs)
+        inside = (times >= start) & (times < end)
+        # Sessions of different users may overlap
+        order = numpy.argsort(times[inside], kind='mergesort')
+        return (times[inside][order].astype('datetime64[s]'),
+                hrs[inside][order])
+
+    def count_sessions(self):
+        """Returns the number of trainings stored."""
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+
+def _parse_time(text):
+    """Returns the datetime of a time given in the command line."""
+    for format_ in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, format_)
+
+        except ValueError:
+            pass
+
+    raise ValueError('Invalid time %s' % text)
+
+
+def _show_help():
+    """Show the help message."""
+    print 'Beurer Heart Rate Monitor Store version: %s' % __VERSION__
+    print 'This software keeps the trainings in a SQLite database'
+    print ''
+    print 'Use:'
+    print ''
+    print '  store.py [-h] [-d database] [-u user] [-v level] path ...'
+    print '  store.py [-d database] [-u user] -f from -t to'
+    print ''
+    print '  -h,        Display this help message'
+    print '  -d file,   Database file, by default'
+    print '             %s' % DATABASE_FILE
+    print '  -u user,   User of the trainings'
+    print '  -f time,   Write the heart rates from the time, as YYYY-MM-DD'
+    print '             or YYYY-MM-DDTHH:MM, as CSV rows'
+    print '  -t time,   Write the heart rates until the time, not included'
+    print '  -v level,  Set the verbose level'
+    print '             1: Debug level'
+    print '             2: Info level'
+    print ''
+    print 'Each path is a dump or a directory of dumps. The trainings'
+    print 'already in the database are skipped.'
+
+
+def _write_hr(store, start, end, user, output):
+    """Write the heart rates of a time range as CSV rows."""
+    (times, hrs) = store.query_hr(start, end, user)
+    output.write('time,hr\n')
+    for (time_, hr) in zip(times.astype(str), hrs.tolist()):
+        output.write('%s,%s\n' % (time_, hr))
+
+
+def main(argv):
+    """Run the store with the command line arguments."""
+    database = DATABASE_FILE
+    user = ''
+    start = None
+    end = None
+
+    # Parser command line options
+    try:
+        opts, args = getopt.getopt(argv, "hd:u:f:t:v:")
+
+        for option in opts:
+            if option[0] == '-d':
+                database = option[1]
+
+            elif option[0] == '-u':
+                user = option[1]
+
+            elif option[0] == '-f':
+                start = _parse_time(option[1])
+
+            elif option[0] == '-t':
+                end = _parse_time(option[1])
+
+            elif option[0] == '-v':
+                if option[1] == '1':
+                    level = logging.DEBUG
+
+                elif option[1] == '2':
+                    level = logging.INFO
+
+                logging.basicConfig(level=level)
+
+            elif option[0] == '-h':
+                _show_help()
+                exit(0)
+
+    except (getopt.GetoptError, ValueError):
+        _show_help()
+        sys.exit(2)
+
+    if (start is None) != (end is None) or not args and start is None:
+        _show_help()
+        sys.exit(2)
+
+    if start is not None:
+        store = SessionStore(database)
+        _write_hr(store, start, end, user or None, sys.stdout)
+        store.close()
+        exit(0)
+
+    from verify import list_paths
+    from exception import HRMException
+    store = SessionStore(database)
+    stored = 0
+    errors = 0
+    start = time.time()
+    for path in list_paths(args):
+        try:
+            stored += store.ingest_file(path, user)
+
+        except (HRMException, EnvironmentError, ValueError) as error:
+            logging.warning('Can not store %s: %s' % (path, error))
+            errors += 1
+
+    logging.info('Stored %s trainings in %.2f seconds.' %
+                 (stored, time.time() - start))
+    print '%s trainings stored, %s in the database.' % \
+        (stored, store.count_sessions())
+    store.close()
+    exit(errors and 1 or 0)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,255 @@
+#! /usr/bin/python
+# -*- coding: utf-8 *-*
+
+# This file is part of the Beurer HRM python interface.
+# Copyright (C) 2013 Andres Moreno
+
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this file.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file writes synthetic dumps of the heart rate monitor.
+#
+# Each training is written as the monitor sends it: header (0x11), results
+# (0x21), fitness (0x31), heart rates (0x41) and laps (0x61), and the dump
+# ends with the end section, every section with its checksum. The heart
+# rates follow a warm up, a workout and a cool down, one sample per minute,
+# and the results are computed from them, so the dumps can be parsed,
+# plotted and downloaded through the simulator as real ones.
+import sys
+import getopt
+import random
+import datetime
+
+__VERSION__ = 0.1
+
+# Oldest training date of the dumps generated by default
+DEFAULT_START = datetime.datetime(2010, 1, 1, 8, 0)
+
+# Longest heart rate section, its length is kept in two bytes
+MAX_MINUTES = 0xFFFF - 3
+
+
+def _bcd(value):
+    """Returns the BCD byte of a value below 100."""
+    return (value // 10) << 4 | value % 10
+
+
+def _section(id_, payload, short=False, flag=0):
+    """Returns a framed section, with its length and checksum.
+
+    Args:
+        id_ -- Id byte of the section
+        payload -- List of bytes after the length
+        short -- The length is a single byte, followed by flag
+        flag -- Byte after the length of the short sections
+
+    """
+    if short:
+        data = [id_, len(payload), flag] + payload
+
+    else:
+        data = [id_, len(payload) & 0xFF, len(payload) >> 8] + payload
+
+    data.append(sum(data) & 0xFF)
+    return bytearray(data)
+
+
+def _split_time(seconds):
+    """Returns the BCD seconds, minutes and hours of a duration."""
+    return [_bcd(seconds % 60), _bcd(seconds // 60 % 60),
+            _bcd(min(seconds // 3600, 99))]
+
+
+def _heart_rates(random_, minutes, rest, peak):
+    """Returns the per minute heart rates of a training."""
+    warm_up = max(minutes // 8, 1)
+    cool_down = max(minutes // 10, 1)
+    level = rest
+    samples = []
+    for minute in range(minutes):
+        if minute < warm_up:
+            target = rest + (peak - rest) * (minute + 1) // warm_up
+
+        elif minute >= minutes - cool_down:
+            target = rest + (peak - rest) * (minutes - minute) // cool_down
+
+        else:
+            target = peak
+
+        level += (target - level) // 2 + random_.randint(-4, 4)
+        level = min(max(level, 40), 220)
+        samples.append(level)
+
+    return samples
+
+
+def generate_training(random_, start, minutes, laps):
+    """Returns the sections of a single training.
+
+    Args:
+        random_ -- random.Random instance used for the values
+        start -- datetime of the start of the training
+        minutes -- Duration of the training, one heart rate per minute
+        laps -- Number of laps, at least one
+
+    """
+    if not 0 < minutes <= MAX_MINUTES:
+        raise ValueError('Wrong training duration.')
+
+    age = random_.randint(20, 60)
+    gender_age = random_.randint(0, 1) << 7 | age
+    maximum = 220 - age
+    high_limit = maximum * 85 // 100
+    low_limit = maximum * 65 // 100
+    samples = _heart_rates(random_, minutes,
+                           random_.randint(60, 80),
+                           random_.randint(low_limit, maximum))
+    # Minutes below, in and over the limits
+    below = len([hr for hr in samples if hr < low_limit])
+    over = len([hr for hr in samples if hr > high_limit])
+    in_zone = len(samples) - below - over
+
+    header = _section(0x11, [gender_age, random_.randint(50, 100),
+                             random_.randint(150, 200), high_limit,
+                             low_limit, maximum], short=True)
+    results = _section(0x21, [gender_age, min(minutes * 10, 0xFF), 0,
+                              random_.randint(5, 30), 0] +
+                       _split_time(in_zone * 60) +
+                       _split_time(below * 60) +
+                       _split_time(over * 60) +
+                       [max(samples), sum(samples) // len(samples)])
+    fitness = _section(0x31, [_bcd(start.minute), _bcd(start.hour),
+                              _bcd(start.day), _bcd(start.month),
+                              _bcd(start.year - 2000),
+                              random_.randint(1, 6),
+                              random_.randint(30, 60)],
+                       short=True, flag=1)
+    heart_rates = _section(0x41, [0, _bcd(start.minute), _bcd(start.hour)] +
+                           samples)
+    lap_data = []
+    lap_seconds = minutes * 60 // laps
+    for lap in range(laps):
+        first = lap * minutes // laps
+        last = max((lap + 1) * minutes // laps, first + 1)
+        lap_data += _split_time(lap_seconds) + \
+            [max(samples[first:last]), 0, 0, 0]
+
+    lap_results = _section(0x61, [0, _bcd(start.second),
+                                  _bcd(start.minute), _bcd(start.hour),
+                                  _bcd(start.day), _bcd(start.month),
+                                  _bcd(start.year - 2000)] + lap_data)
+    return header + results + fitness + heart_rates + lap_results
+
+
+def generate_dump(trainings=1, minutes=60, laps=1, seed=None,
+                  start=DEFAULT_START):
+    """Returns a synthetic dump as a bytearray.
+
+    The trainings are one or two days apart, starting at start, and each
+    one lasts from half to the whole given minutes.
+
+    Args:
+        trainings -- Number of trainings in the dump
+        minutes -- Longest training duration
+        laps -- Most laps of a training
+        seed -- Seed of the values, for repeatable dumps
+        start -- datetime of the first training
+
+    """
+    random_ = random.Random(seed)
+    dump = bytearray()
+    for training in range(trainings):
+        dump += generate_training(random_, start,
+                                  random_.randint(max(minutes // 2, 1),
+                                                  minutes),
+                                  random_.randint(1, laps))
+        start += datetime.timedelta(days=random_.randint(1, 2),
+                                    minutes=random_.randint(-60, 60))
+
+    dump += _section(0x01, [])
+    return dump
+
+
+def write_dump(path, trainings=1, minutes=60, laps=1, seed=None):
+    """Write a synthetic dump to a file, see generate_dump."""
+    hfile = open(path, 'wb')
+    hfile.write(generate_dump(trainings, minutes, laps, seed))
+    hfile.close()
+
+
+def _show_help():
+    """Show the help message."""
+    print 'Beurer Heart Rate Monitor Dump Generator version: %s' % \
+        __VERSION__
+    print 'This software writes synthetic heart rate monitor dumps'
+    print ''
+    print 'Use:'
+    print ''
+    print '  synthetic.py [-h] [-n trainings] [-m minutes] [-l laps]'
+    print '               [-s seed] [-o outputfile]'
+    print ''
+    print '  -h,        Display this help message'
+    print '  -n number, Number of trainings, 1 by default'
+    print '  -m number, Longest training in minutes, 60 by default'
+    print '  -l number, Most laps of a training, 1 by default'
+    print '  -s seed,   Seed of the values, for repeatable dumps'
+    print '  -o,        Redirect output to a file'
+
+
+if __name__ == '__main__':
+    outputfile = None
+    trainings = 1
+    minutes = 60
+    laps = 1
+    seed = None
+
+    # Parser command line options
+    try:
+        argv = sys.argv[1:]
+        opts, args = getopt.getopt(argv, "hn:m:l:s:o:")
+
+        for option in opts:
+            if option[0] == '-n':
+                trainings = int(option[1])
+
+            elif option[0] == '-m':
+                minutes = int(option[1])
+
+            elif option[0] == '-l':
+                laps = int(option[1])
+
+            elif option[0] == '-s':
+                seed = int(option[1])
+
+            elif option[0] == '-o':
+                outputfile = option[1]
+
+            elif option[0] == '-h':
+                _show_help()
+                exit(0)
+
+    except (getopt.GetoptError, ValueError):
+        _show_help()
+        sys.exit(2)
+
+    if trainings < 0 or not 0 < minutes <= MAX_MINUTES or laps < 1:
+        _show_help()
+        sys.exit(2)
+
+    if outputfile is None:
+        sys.stdout.write(generate_dump(trainings, minutes, laps, seed))
+
+    else:
+        write_dump(outputfile, trainings, minutes, laps, seed)
+
+    exit(0)
@@ -0,0 +1,47 @@
+#! /usr/bin/python
+# -*- coding: utf-8 *-*
+
+# This file is part of the Beurer HRM python interface.
+# Copyright (C) 2013 Andres Moreno
+
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this file.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file provides the transport used to reach the heart rate monitors.
+#
+# A transport finds the devices and names them. The devices it returns
+# are used by HeartRateMonitor through set_configuration(), ctrl_transfer()
+# and their bus and address attributes, as pyusb devices do. See
+# simulator.py for a transport that does not need any hardware.
+import usb.core
+import usb.util
+
+
+class USBTransport(object):
+
+    """Access the monitors through the USB bus using pyusb."""
+
+    # Exceptions raised by failed transfers
+    errors = (usb.core.USBError,)
+
+    def find_devices(self, id_vendor, id_product):
+        """Returns every attached device with the given ids."""
+        return list(usb.core.find(find_all=True, idVendor=id_vendor,
+                                  idProduct=id_product))
+
+    def get_serial(self, device):
+        """Returns the serial number of a device, None if it has none."""
+        if not device.iSerialNumber:
+            return None
+
+        return usb.util.get_string(device, device.iSerialNumber)
@@ -0,0 +1,225 @@
+#! /usr/bin/python
+# -*- coding: utf-8 *-*
+
+# This file is part of the Beurer HRM python interface.
+# Copyright (C) 2013 Andres Moreno
+
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this file.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file checks the framing and checksums of stored dumps.
+#
+# Only the section frames are read, no report is built, and the files are
+# spread over a pool of processes. Every problem found is written as a JSON
+# line with the file, the offset of the bad section, its id and the error.
+import os
+import sys
+import json
+import getopt
+import logging
+import itertools
+import multiprocessing
+
+from section import FRAME_SIZE, END_SECTION
+from section import byte_at, map_file, section_size, section_checksum
+
+__VERSION__ = 0.1
+
+# Errors found in the dumps
+CHECKSUM_ERROR = 'checksum'
+TRUNCATED_ERROR = 'truncated'
+TRAILING_ERROR = 'trailing'
+END_ERROR = 'end'
+
+
+def verify_buffer(buffer_):
+    """Check every section of a dump.
+
+    Returns a list of (offset, id, error) tuples, one per problem found:
+    a section with a wrong checksum, a section cut by the end of the data,
+    bytes too few to hold a section at the end, or data not finished by an
+    end section. The id is None when there is no section at the offset.
+
+    """
+    problems = []
+    position = 0
+    end = len(buffer_)
+    last_type = None
+    while end - position >= FRAME_SIZE:
+        id_ = byte_at(buffer_, position)
+        size = section_size(buffer_, position)
+        if end - position < size:
+            problems.append((position, id_, TRUNCATED_ERROR))
+            return problems
+
+        if section_checksum(buffer_, position, size) != \
+                byte_at(buffer_, position + size - 1):
+            problems.append((position, id_, CHECKSUM_ERROR))
+
+        last_type = id_ >> 4
+        position += size
+
+    if position < end:
+        problems.append((position, None, TRAILING_ERROR))
+
+    elif last_type != END_SECTION:
+        problems.append((end, None, END_ERROR))
+
+    return problems
+
+
+def verify_file(path):
+    """Check every section of a dump file.
+
+    Returns a (path, size, problems, error) tuple, problems being the list
+    returned by verify_buffer and error the error message, or None if the
+    file could be read.
+
+    """
+    try:
+        buffer_ = map_file(path)
+        return (path, len(buffer_), verify_buffer(buffer_), None)
+
+    except EnvironmentError as error:
+        return (path, 0, [], str(error))
+
+
+def iter_verify(paths, jobs):
+    """Iterate over the verify_file results in completion order."""
+    if jobs == 1:
+        for result in itertools.imap(verify_file, paths):
+            yield result
+
+        return
+
+    # Small files are handed out in groups to keep the pool busy
+    chunk_size = max(len(paths) // (jobs * 4), 1)
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap_unordered(verify_file, paths, chunk_size):
+            yield result
+
+    finally:
+        pool.close()
+
+
+def run_verify(paths, output, jobs=None):
+    """Check a list of dumps writing every problem as a JSON line.
+
+    Args:
+        paths -- Paths of the dump files
+        output -- File object where the problems are written
+        jobs -- Number of processes, by default one per cpu
+
+    Returns the number of files with problems.
+
+    """
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    paths = list(paths)
+    bad_files = 0
+    total_size = 0
+    for (path, size, problems, error) in iter_verify(paths, jobs):
+        total_size += size
+        if error is not None:
+            output.write(json.dumps({'file': path, 'offset': None,
+                                     'id': None, 'error': error},
+                                    sort_keys=True) + '\n')
+
+        for (offset, id_, problem) in problems:
+            output.write(json.dumps({'file': path, 'offset': offset,
+                                     'id': id_, 'error': problem},
+                                    sort_keys=True) + '\n')
+
+        if error is not None or problems:
+            bad_files += 1
+
+    logging.info('Verified %s files, %s bytes, %s with problems.' %
+                 (len(paths), total_size, bad_files))
+    return bad_files
+
+
+def list_paths(paths):
+    """Returns the dump files given, with the dumps under directories."""
+    from batch import list_dumps
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(list_dumps(path))
+
+        else:
+            files.append(path)
+
+    return files
+
+
+def _show_help():
+    """Show the help message."""
+    print 'Beurer Heart Rate Monitor Verifier version: %s' % __VERSION__
+    print 'This software checks the framing and checksums of the dumps'
+    print ''
+    print 'Use:'
+    print ''
+    print '  verify.py [-h] [-j jobs] [-v level] path ...'
+    print ''
+    print '  -h,        Display this help message'
+    print '  -j number, Number of processes, defaults to the number of cpus'
+    print '  -v level,  Set the verbose level'
+    print '             1: Debug level'
+    print '             2: Info level'
+    print ''
+    print 'Each path is a dump or a directory of dumps. Every bad section'
+    print 'is written as a JSON line to stdout, and the exit status is 1'
+    print 'if any problem was found.'
+
+
+def main(argv):
+    """Run the verifier with the command line arguments."""
+    jobs = None
+
+    # Parser command line options
+    try:
+        opts, args = getopt.getopt(argv, "hj:v:", ["jobs="])
+
+        for option in opts:
+            if option[0] in ('-j', '--jobs'):
+                jobs = int(option[1])
+
+            elif option[0] == '-v':
+                if option[1] == '1':
+                    level = logging.DEBUG
+
+                elif option[1] == '2':
+                    level = logging.INFO
+
+                logging.basicConfig(level=level)
+
+            elif option[0] == '-h':
+                _show_help()
+                exit(0)
+
+    except (getopt.GetoptError, ValueError):
+        _show_help()
+        sys.exit(2)
+
+    if not args or jobs is not None and jobs < 1:
+        _show_help()
+        sys.exit(2)
+
+    bad_files = run_verify(list_paths(args), sys.stdout, jobs)
+    exit(bad_files and 1 or 0)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
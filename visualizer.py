@@ -18,62 +18,108 @@
 # along with this file.  If not, see <http://www.gnu.org/licenses/>.
 
 # This file show the data read from the heart rate monitor using matplotlib
+#
+# Series longer than the point budget are downsampled with LTTB before
+# being drawn. The --render-dir mode draws every training of the dumps into
+# image files on the AGG backend, one file per training, using a pool of
+# processes, so it runs on servers without a display.
+#
+# Matplotlib, numpy and PySide take long to import, so they are imported
+# by the methods using them, not when the module is loaded.
+import os
+import sys
 import getopt
-from matplotlib import use
-use('AGG')
-from matplotlib import pyplot as plt
-from matplotlib.pylab import *
-from matplotlib import dates
-from PySide import QtGui
+import logging
 import datetime
+import multiprocessing
 
-from parser import Parser
+from parser import Parser, map_file
+from cache import ReportCache
+from exception import HRMException
 
 __VERSION__ = 0.1
 
+# Most points drawn for a heart rate series
+MAX_POINTS = 2000
+# Image formats of the rendered trainings
+RENDER_FORMATS = ('png', 'svg')
+
+# Errors of a dump or a training that can not be rendered
+_RENDER_ERRORS = (HRMException, EnvironmentError, ValueError)
+
 
 class Visualizer(object):
 
     """Show the heart rate data in a window using Qt."""
 
-    def __init__(self):
-        """Initializes the object."""
+    def __init__(self, cache=None, max_points=MAX_POINTS):
+        """Initializes the object.
+
+        Args:
+            cache -- ReportCache used to parse the data, if any
+            max_points -- Most points drawn, longer series are downsampled
+
+        """
+        self.cache = cache
+        self.max_points = max_points
 
     def _get_data(self, stream):
         """Get the necessary data to plot."""
-        parser = Parser()
-        report = parser.parse(stream)
+        if self.cache is None:
+            report = Parser().parse(stream)
+
+        else:
+            report = self.cache.parse(stream)
+
+        return self._report_data(report)
+
+    def _report_data(self, report):
+        """Get the data to plot from a report."""
+        import numpy
+        from matplotlib import dates
         hr_data = report.hr_data
         start_time = datetime.datetime(report.lr_data_year,
                                        report.lr_data_month,
                                        report.lr_data_day,
                                        report.hr_data_hour,
                                        report.hr_data_min)
-        delta_time = datetime.timedelta(minutes=1)
-        time_data = []
-        for i in range(len(hr_data)):
-            time_data.append(start_time + delta_time * i)
+        # One sample per minute, date numbers are expressed in days
+        time_data = dates.date2num(start_time) + \
+                    numpy.arange(len(hr_data)) / (24.0 * 60)
+        hr_data = numpy.frombuffer(hr_data, dtype=numpy.uint8)
 
-        time_data = dates.date2num(time_data)
+        return (hr_data, time_data)
 
+    def _downsample(self, hr_data, time_data):
+        """Reduce the series to the point budget, keeping its shape."""
+        if len(hr_data) <= self.max_points:
+            return (hr_data, time_data)
+
+        from downsample import lttb
+        (time_data, hr_data) = lttb(time_data, hr_data, self.max_points)
         return (hr_data, time_data)
 
     def plot(self, stream):
         """Plot the HR data."""
-        (hr_data, time_data) = self._get_data(stream)
+        (hr_data, time_data) = self._downsample(*self._get_data(stream))
         self._plot(hr_data, time_data)
 
     def _plot(self, hr_data, time_data):
         """Plot the data into the window"""
-        plot(time_data, hr_data, linewidth=2, linestyle='-',
-             marker=r'$\dot$', markersize=5, label='Heart rates')
-        grid(True)
+        from matplotlib import use
+        use('AGG')
+        from matplotlib import pyplot as plt
+        from matplotlib import dates
+        from PySide import QtGui
+        plt.plot(time_data, hr_data, linewidth=2, linestyle='-',
+                 marker=r'$\dot$', markersize=5, label='Heart rates')
+        plt.grid(True)
         plt.xticks(rotation='vertical')
-        legend(loc='upper left')
+        plt.legend(loc='upper left')
         plt.subplots_adjust(bottom=.2)
         date_format = dates.DateFormatter('%m/%d %H:%M')
 
-        figure = gcf()
+        figure = plt.gcf()
         ax = figure.add_subplot(111)
         ax.xaxis.set_major_formatter(date_format)
 
@@ -93,6 +139,114 @@ class Visualizer(object):
 
         app.exec_()
 
+    def render(self, report, path):
+        """Draw the heart rates of a report into an image file.
+
+        The figure is drawn on its own AGG canvas, no window nor pyplot
+        state is used. The image format is given by the path extension.
+
+        """
+        from matplotlib import dates
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        (hr_data, time_data) = self._downsample(*self._report_data(report))
+        figure = Figure(figsize=(10, 5))
+        FigureCanvasAgg(figure)
+        ax = figure.add_subplot(111)
+        ax.plot(time_data, hr_data, linewidth=1, linestyle='-',
+                label='Heart rates')
+        ax.grid(True)
+        ax.legend(loc='upper left')
+        ax.xaxis.set_major_formatter(dates.DateFormatter('%m/%d %H:%M'))
+        for label in ax.get_xticklabels():
+            label.set_rotation('vertical')
+
+        figure.subplots_adjust(bottom=.2)
+        figure.savefig(path)
+
+    def render_dump(self, path, directory, format_='png'):
+        """Draw every training of a dump, one image file per training.
+
+        The images are named after the dump and the training number. A
+        training that can not be drawn is skipped, the rest are drawn.
+
+        Returns an (images, errors) tuple, the paths of the images written
+        and the error messages of the trainings, or the dump, that could
+        not be rendered.
+
+        """
+        images = []
+        errors = []
+        name = os.path.basename(path)
+        try:
+            if self.cache is None:
+                reports = Parser().iter_reports(map_file(path))
+
+            else:
+                reports = self.cache.parse_reports(map_file(path))
+
+            for (ordinal, report) in enumerate(reports):
+                image = os.path.join(directory, '%s-%03d.%s' %
+                                     (name, ordinal, format_))
+                try:
+                    self.render(report, image)
+
+                except _RENDER_ERRORS as error:
+                    errors.append('training %s: %s' %
+                                  (ordinal, _error_message(error)))
+                    continue
+
+                images.append(image)
+
+        except _RENDER_ERRORS as error:
+            errors.append(_error_message(error))
+
+        return (images, errors)
+
+
+def _error_message(error):
+    """Returns the message of an error, or its name if it has none."""
+    return str(error) or error.__class__.__name__
+
+
+def _render_dump(args):
+    """Render a dump in a pool process, see render_all."""
+    (visualizer, path, directory, format_) = args
+    return (path,) + visualizer.render_dump(path, directory, format_)
+
+
+def render_all(visualizer, paths, directory, format_='png', jobs=None):
+    """Render every training of a list of dumps using a pool of processes.
+
+    Args:
+        visualizer -- Visualizer drawing the images
+        paths -- Paths of the dump files
+        directory -- Directory where the images are written
+        format_ -- Image format, one of RENDER_FORMATS
+        jobs -- Number of processes, by default one per cpu
+
+    Returns a list of (path, images, errors) tuples, see render_dump,
+    errors being empty for the dumps fully rendered.
+
+    """
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    tasks = [(visualizer, path, directory, format_) for path in paths]
+    if jobs == 1:
+        return map(_render_dump, tasks)
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        return pool.map(_render_dump, tasks, 1)
+
+    finally:
+        pool.close()
+        pool.join()
+
 
 def _show_help():
     """Show the help message."""
@@ -101,32 +255,103 @@ def _show_help():
     print ''
     print 'Use:'
     print ''
-    print '  beurer.py [-h] [-i inputfile]'
+    print '  visualizer.py [-h] [-c] [-p points] [-i inputfile]'
+    print '  visualizer.py --render-dir dir [--format format]'
+    print '                [--jobs number] [-c] [-p points] -i input'
     print ''
-    print '  -h,        Display this help message'
-    print '  -i file,   Read data from file'
+    print '  -h,            Display this help message'
+    print '  -i file,       Read data from file'
+    print '  -c,            Keep the parsed data in a cache'
+    print '  -p number,     Most points drawn, longer series are'
+    print '                 downsampled, %s by default' % MAX_POINTS
+    print '  --render-dir,  Draw every training of the input into image'
+    print '                 files in the directory, without a window. The'
+    print '                 input may be a dump or a directory of dumps'
+    print '  --format,      Image format of --render-dir, png (default)'
+    print '                 or svg'
+    print '  --jobs,        Number of processes used by --render-dir,'
+    print '                 defaults to the number of cpus'
 
 
-if __name__ == '__main__':
+def main(argv):
+    """Run the visualizer with the command line arguments."""
     inputfile = sys.stdin
+    inputpath = None
+    cache = None
+    max_points = MAX_POINTS
+    render_dir = None
+    format_ = 'png'
+    jobs = None
 
     # Parser command line options
     try:
-        argv = sys.argv[1:]
-        opts, args = getopt.getopt(argv, "hi:")
+        opts, args = getopt.getopt(argv, "hci:p:",
+                                   ["render-dir=", "format=", "jobs="])
 
         for option in opts:
             if option[0] == '-i':
-                inputfile = open(option[1], 'r')
+                inputpath = option[1]
+
+            elif option[0] == '-c':
+                cache = ReportCache()
+
+            elif option[0] == '-p':
+                max_points = int(option[1])
+
+            elif option[0] == '--render-dir':
+                render_dir = option[1]
+
+            elif option[0] == '--format':
+                format_ = option[1]
+
+            elif option[0] == '--jobs':
+                jobs = int(option[1])
 
             elif option[0] == '-h':
                 _show_help()
                 exit(0)
 
-    except getopt.GetoptError:
+    except (getopt.GetoptError, ValueError):
         _show_help()
         sys.exit(2)
 
-    v = Visualizer()
+    if max_points < 3:
+        _show_help()
+        sys.exit(2)
+
+    v = Visualizer(cache, max_points)
+    if render_dir is not None:
+        from batch import list_dumps
+        if inputpath is None or format_ not in RENDER_FORMATS or \
+                jobs is not None and jobs < 1:
+            _show_help()
+            sys.exit(2)
+
+        if os.path.isdir(inputpath):
+            paths = list_dumps(inputpath)
+
+        else:
+            paths = [inputpath]
+
+        errors = 0
+        for (path, images, messages) in render_all(v, paths, render_dir,
+                                                   format_, jobs):
+            for message in messages:
+                logging.warning('Can not render %s: %s' % (path, message))
+
+            if messages:
+                errors += 1
+
+            for image in images:
+                print image
+
+        exit(errors and 1 or 0)
+
+    if inputpath is not None:
+        inputfile = map_file(inputpath)
+
     v.plot(inputfile)
-    inputfile.close()
\ No newline at end of file
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,339 @@
+#! /usr/bin/python
+# -*- coding: utf-8 *-*
+
+# This file is part of the Beurer HRM python interface.
+# Copyright (C) 2013 Andres Moreno
+
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this file.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file downloads the monitors as soon as they are plugged.
+#
+# The watcher looks for new monitors every few seconds, sleeping in
+# between, and a SIGUSR1 makes it look at once, so a udev rule can wake it
+# when the bridge is plugged (see 40-megawin.rules) and the polling can be
+# slow. Every new monitor is downloaded into the archive directory, and the
+# dump is handed to a background thread that saves its reports next to it
+# while the watcher goes back to sleep.
+import os
+import sys
+import time
+import Queue
+import getopt
+import signal
+import logging
+import threading
+
+from beurer import DEFAULT_BAUD_RATE, AUTO_BAUD_RATE, download_all
+from beurer import find_monitors
+from transport import USBTransport
+from exception import HRMException
+from report import REPORT_SUFFIX
+
+__VERSION__ = 0.1
+
+# Seconds between looks for new monitors
+POLL_INTERVAL = 2.0
+# Downloads of a monitor failed before giving up until it is plugged again
+MAX_ATTEMPTS = 5
+# Seconds before downloading a failed monitor again, doubled on every
+# failure
+RETRY_INTERVAL = 30.0
+
+
+class MonitorWatcher(object):
+
+    """Download every monitor plugged and parse its data."""
+
+    def __init__(self, directory, transport=None, interval=POLL_INTERVAL,
+                 baud_rate=DEFAULT_BAUD_RATE, delete=False, on_parsed=None):
+        """Initializes the object.
+
+        Args:
+            directory -- Archive directory where the dumps are written
+            transport -- Transport used to reach the monitors, USB by default
+            interval -- Seconds between looks for new monitors
+            baud_rate -- Baud rate, or AUTO_BAUD_RATE
+            delete -- Delete the data from the monitors after reading it
+            on_parsed -- Function called as on_parsed(path, reports) after
+                         the reports of a dump are saved
+
+        """
+        if transport is None:
+            transport = USBTransport()
+
+        self.directory = directory
+        self.transport = transport
+        self.interval = interval
+        self.baud_rate = baud_rate
+        self.delete = delete
+        self.on_parsed = on_parsed
+        self.queue = Queue.Queue()
+        self.stopped = False
+        self.max_attempts = MAX_ATTEMPTS
+        self.retry_interval = RETRY_INTERVAL
+        # Bus and address of the monitors attached and downloaded, or given
+        # up, a plugged again monitor gets a new address
+        self._attached = set()
+        # Failed downloads and time of the next attempt of each monitor
+        self._failures = {}
+        self._parser_thread = None
+
+    def check(self):
+        """Download the monitors plugged since the last check.
+
+        Returns the list of (name, path, error) tuples of download_all.
+
+        """
+        now = time.time()
+        devices = find_monitors(transport=self.transport)
+        attached = set((device.bus, device.address) for device in devices)
+        # Forget the monitors unplugged
+        self._attached &= attached
+        for key in set(self._failures) - attached:
+            del self._failures[key]
+
+        new = [device for device in devices
+               if (device.bus, device.address) not in self._attached and
+               self._failures.get((device.bus, device.address),
+                                  (0, 0))[1] <= now]
+        if not new:
+            return []
+
+        logging.info('%s monitors to download.' % len(new))
+        results = download_all(self.directory, self.delete, self.baud_rate,
+                               devices=new, transport=self.transport)
+        for (device, (name, path, error)) in zip(new, results):
+            key = (device.bus, device.address)
+            if error is None:
+                self._attached.add(key)
+                self._failures.pop(key, None)
+                self.queue.put(path)
+                continue
+
+            attempts = self._failures.get(key, (0, 0))[0] + 1
+            if attempts >= self.max_attempts:
+                logging.error('Giving up %s until it is plugged again.' %
+                              name)
+                self._attached.add(key)
+                self._failures.pop(key, None)
+                continue
+
+            delay = self.retry_interval * 2 ** (attempts - 1)
+            logging.warning('Downloading %s again in %.0f seconds.' %
+                            (name, delay))
+            self._failures[key] = (attempts, now + delay)
+
+        return results
+
+    def run(self):
+        """Watch for monitors until stop is called."""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        self.start_parser()
+        errors = (HRMException, EnvironmentError) + self.transport.errors
+        try:
+            while not self.stopped:
+                try:
+                    self.check()
+
+                except errors as error:
+                    logging.error('Can not look for monitors: %s' % error)
+
+                # Interrupted at once by the signals, see wake_on_signal
+                time.sleep(self.interval)
+
+        finally:
+            # The dumps queued are parsed before returning
+            self.queue.put(None)
+            self._parser_thread.join()
+
+    def stop(self):
+        """Stop watching after the current check."""
+        self.stopped = True
+
+    def wake_on_signal(self, signum=signal.SIGUSR1):
+        """Look for new monitors as soon as the signal is received."""
+        signal.signal(signum, lambda signum, frame: None)
+
+    def start_parser(self):
+        """Start the thread parsing the downloaded dumps."""
+        self._parser_thread = threading.Thread(target=self._parse_dumps)
+        self._parser_thread.daemon = True
+        self._parser_thread.start()
+
+    def _parse_dumps(self):
+        """Parse the dumps queued until None is received."""
+        from parser import Parser
+        from report import save_reports
+        from section import map_file
+        while True:
+            path = self.queue.get()
+            if path is None:
+                break
+
+            try:
+                reports = list(Parser().iter_reports(map_file(path)))
+                save_reports(path + REPORT_SUFFIX, reports)
+                if self.on_parsed is not None:
+                    self.on_parsed(path, reports)
+
+            except (HRMException, EnvironmentError, ValueError) as error:
+                logging.error('Can not parse %s: %s' % (path, error))
+                continue
+
+            logging.info('Parsed %s trainings of %s.' % (len(reports), path))
+
+
+def _write_pidfile(path):
+    """Write the process id, for the udev rule to signal it."""
+    hfile = open(path, 'w')
+    hfile.write('%s\n' % os.getpid())
+    hfile.close()
+
+
+def _store_reports(database, path, reports):
+    """Store the reports of a dump, from the parser thread."""
+    import sqlite3
+    from store import SessionStore
+    try:
+        # The connections can not be shared between threads
+        store = SessionStore(database)
+        try:
+            stored = store.ingest_reports(reports, source=path)
+
+        finally:
+            store.close()
+
+    except sqlite3.Error as error:
+        logging.error('Can not store %s: %s' % (path, error))
+        return
+
+    logging.info('Stored %s trainings of %s.' % (stored, path))
+
+
+def _show_help():
+    """Show the help message."""
+    print 'Beurer Heart Rate Monitor Watcher version: %s' % __VERSION__
+    print 'This software downloads the monitors as soon as they are plugged'
+    print ''
+    print 'Use:'
+    print ''
+    print '  watch.py [-h] [-d] [-b rate] [-i seconds] [-p pidfile]'
+    print '           [-r dumpfile] [-s database] [-v level] directory'
+    print ''
+    print '  -h,        Display this help message'
+    print '  -d,        Delete de data from the HRM'
+    print '  -b rate,   Baud rate, 9600 by default, or auto'
+    print '  -i number, Seconds between looks for new monitors, %s by' % \
+        POLL_INTERVAL
+    print '             default. SIGUSR1 makes the watcher look at once'
+    print '  -p file,   Write the process id to the file'
+    print '  -r file,   Watch a simulated monitor replaying the dump'
+    print '  -s file,   Store the trainings in the database, see store.py'
+    print '  -v level,  Set the verbose level'
+    print '             1: Debug level'
+    print '             2: Info level'
+    print ''
+    print 'The dumps are written into the directory, with the reports of'
+    print 'each one in a %s file next to it.' % REPORT_SUFFIX
+
+
+def main(argv):
+    """Run the watcher with the command line arguments."""
+    deleteflag = False
+    baud_rate = DEFAULT_BAUD_RATE
+    interval = POLL_INTERVAL
+    pidfile = None
+    transport = None
+    database = None
+
+    # Parser command line options
+    try:
+        opts, args = getopt.getopt(argv, "hdb:i:p:r:s:v:")
+
+        for option in opts:
+            if option[0] == '-d':
+                deleteflag = True
+
+            elif option[0] == '-b':
+                if option[1] == AUTO_BAUD_RATE:
+                    baud_rate = AUTO_BAUD_RATE
+
+                else:
+                    baud_rate = int(option[1])
+
+            elif option[0] == '-i':
+                interval = float(option[1])
+
+            elif option[0] == '-p':
+                pidfile = option[1]
+
+            elif option[0] == '-r':
+                from section import map_file
+                from simulator import SimulatedMonitor, SimulatedTransport
+                transport = SimulatedTransport(
+                    [SimulatedMonitor(map_file(option[1]))])
+
+            elif option[0] == '-s':
+                database = option[1]
+
+            elif option[0] == '-v':
+                if option[1] == '1':
+                    level = logging.DEBUG
+
+                elif option[1] == '2':
+                    level = logging.INFO
+
+                logging.basicConfig(level=level)
+
+            elif option[0] == '-h':
+                _show_help()
+                exit(0)
+
+    except (getopt.GetoptError, ValueError):
+        _show_help()
+        sys.exit(2)
+
+    if len(args) != 1 or interval <= 0:
+        _show_help()
+        sys.exit(2)
+
+    if pidfile is not None:
+        _write_pidfile(pidfile)
+
+    on_parsed = None
+    if database is not None:
+        on_parsed = lambda path, reports: _store_reports(database, path,
+                                                         reports)
+
+    watcher = MonitorWatcher(args[0], transport, interval, baud_rate,
+                             deleteflag, on_parsed)
+    watcher.wake_on_signal()
+    signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+    try:
+        watcher.run()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        if pidfile is not None and os.path.exists(pidfile):
+            os.remove(pidfile)
+
+    exit(0)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])